@@ -350,16 +350,25 @@ func processJob(jobID, filePath, stemMode, isolateStem, outputFormat, model, seg
 	}
 	defer resp.Body.Close()
 
-	if resp.StatusCode != http.StatusOK {
-		respBody, _ := io.ReadAll(resp.Body)
-		updateJobError(jobID, "Processor failed: "+string(respBody))
-		return
-	}
-
 	// Parse response
 	var result map[string]interface{}
-	if err := json.NewDecoder(resp.Body).Decode(&result); err != nil {
-		updateJobError(jobID, "Failed to parse response")
+	switch resp.StatusCode {
+	case http.StatusOK:
+		// Served straight from the processor's result cache
+		if err := json.NewDecoder(resp.Body).Decode(&result); err != nil {
+			updateJobError(jobID, "Failed to parse response")
+			return
+		}
+	case http.StatusAccepted:
+		// Queued; the processor reports the outcome through its status endpoint
+		result, err = waitForProcessor(processorURL, jobID)
+		if err != nil {
+			updateJobError(jobID, err.Error())
+			return
+		}
+	default:
+		respBody, _ := io.ReadAll(resp.Body)
+		updateJobError(jobID, "Processor failed: "+string(respBody))
 		return
 	}
 
@@ -386,6 +395,69 @@ func processJob(jobID, filePath, stemMode, isolateStem, outputFormat, model, seg
 	jobsMutex.Unlock()
 }
 
+// waitForProcessor polls the processor status endpoint until the job finishes
+// and returns the final status, which includes the output files.
+func waitForProcessor(processorURL, jobID string) (map[string]interface{}, error) {
+	client := &http.Client{Timeout: 10 * time.Second}
+	// The processor stops a separation after 30 minutes; allow a few more for
+	// collecting the stems. Time spent queued behind other jobs does not count:
+	// the deadline restarts on every poll that finds the job still queued.
+	const processingTimeout = 35 * time.Minute
+	deadline := time.Now().Add(processingTimeout)
+	// ETag and state of the last status read; the processor answers 304 while it is unchanged
+	etag := ""
+	state := ""
+
+	for time.Now().Before(deadline) {
+		time.Sleep(2 * time.Second)
+
+		req, err := http.NewRequest("GET", processorURL+"/status/"+jobID, nil)
+		if err != nil {
+			return nil, err
+		}
+		if etag != "" {
+			req.Header.Set("If-None-Match", etag)
+		}
+		resp, err := client.Do(req)
+		if err != nil {
+			continue
+		}
+		if resp.StatusCode == http.StatusNotModified {
+			resp.Body.Close()
+			if state == "queued" {
+				deadline = time.Now().Add(processingTimeout)
+			}
+			continue
+		}
+		var status map[string]interface{}
+		err = json.NewDecoder(resp.Body).Decode(&status)
+		resp.Body.Close()
+		if err != nil {
+			continue
+		}
+		etag = resp.Header.Get("ETag")
+		state, _ = status["status"].(string)
+
+		switch state {
+		case "queued":
+			deadline = time.Now().Add(processingTimeout)
+		case "completed":
+			return status, nil
+		case "failed":
+			errMsg, _ := status["error"].(string)
+			if details, ok := status["details"].(string); ok && details != "" {
+				errMsg += ": " + details
+			}
+			return nil, fmt.Errorf("Processor failed: %s", errMsg)
+		case "cancelled":
+			return nil, fmt.Errorf("Processing cancelled")
+		case "unknown":
+			return nil, fmt.Errorf("Processor lost track of job")
+		}
+	}
+	return nil, fmt.Errorf("Processing timed out")
+}
+
 func updateJobError(jobID, errMsg string) {
 	jobsMutex.Lock()
 	defer jobsMutex.Unlock()
@@ -506,7 +578,16 @@ func processingStatusHandler(w http.ResponseWriter, r *http.Request) {
 	}
 
 	client := &http.Client{Timeout: 5 * time.Second}
-	resp, err := client.Get(processorURL + "/status/" + jobID)
+	req, err := http.NewRequest("GET", processorURL+"/status/"+jobID, nil)
+	if err != nil {
+		http.Error(w, "Invalid processor URL", http.StatusInternalServerError)
+		return
+	}
+	// Pass the browser's cached ETag through so unchanged statuses come back as 304
+	if inm := r.Header.Get("If-None-Match"); inm != "" {
+		req.Header.Set("If-None-Match", inm)
+	}
+	resp, err := client.Do(req)
 	if err != nil {
 		// Return default status if processor is not reachable
 		w.Header().Set("Content-Type", "application/json")
@@ -520,6 +601,13 @@ func processingStatusHandler(w http.ResponseWriter, r *http.Request) {
 	defer resp.Body.Close()
 
 	// Forward the response
+	if etag := resp.Header.Get("ETag"); etag != "" {
+		w.Header().Set("ETag", etag)
+	}
+	if resp.StatusCode == http.StatusNotModified {
+		w.WriteHeader(http.StatusNotModified)
+		return
+	}
 	w.Header().Set("Content-Type", "application/json")
 	body, _ := io.ReadAll(resp.Body)
 	w.Write(body)
@@ -600,8 +688,10 @@ func downloadHandler(w http.ResponseWriter, r *http.Request) {
 	// Set headers before writing body
 	w.Header().Set("Content-Disposition", fmt.Sprintf("attachment; filename=\"%s\"", fileName))
 	w.Header().Set("Content-Type", contentType)
-	w.Header().Set("Content-Length", fmt.Sprintf("%d", fileInfo.Size()))
+	// Stems never change once written, so size and mtime identify the content
+	w.Header().Set("ETag", fmt.Sprintf("\"%x-%x\"", fileInfo.Size(), fileInfo.ModTime().UnixNano()))
 
-	// Stream the file
-	io.Copy(w, file)
+	// ServeContent sets Content-Length, answers Range and conditional requests
+	// (206/304), and streams full responses with sendfile
+	http.ServeContent(w, r, fileName, fileInfo.ModTime(), file)
 }
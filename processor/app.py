@@ -1,20 +1,30 @@
 import os
 import sys
+import errno
 import subprocess
 import logging
 import traceback
 import threading
 import time
 import re
+import hashlib
+import tempfile
 import pty
-import select
-from flask import Flask, request, jsonify
+import selectors
+from flask import Flask, Request, request, jsonify, url_for
 from werkzeug.utils import secure_filename
 import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import separator
 
-# Validation pattern for job IDs: alphanumeric characters and hyphens only (up to 255 characters)
-JOB_ID_PATTERN = re.compile(r'^[a-zA-Z0-9][a-zA-Z0-9\-]{0,254}$')
-ALLOWED_OUTPUT_FORMATS = {'mp3', 'wav', 'flac'}
+# Validation pattern for job IDs: alphanumeric characters and hyphens only (up to 255 characters).
+# Used with fullmatch; a '^...$' match would also accept a trailing newline.
+JOB_ID_PATTERN = re.compile(r'[a-zA-Z0-9][a-zA-Z0-9\-]{0,254}')
+# tqdm progress token in demucs output (matched on raw bytes) and ANSI escape codes
+PROGRESS_PATTERN = re.compile(rb'(\d{1,3})%\|')
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;]*[mK]')
+ALLOWED_OUTPUT_FORMATS = frozenset({'mp3', 'wav', 'flac'})
 # Canonical mapping for demucs model CLI argument values (defense-in-depth for subprocess args).
 # Keys are accepted request values; values are the exact, hard-coded CLI literals passed to demucs.
 # This is the single source of truth for both validation and canonicalization.
@@ -30,22 +40,41 @@ DEMUCS_MODEL_ARG_MAP = {
 }
 # Allowlisted Demucs models accepted from user input (derived from the canonical map)
 ALLOWED_DEMUCS_MODELS = frozenset(DEMUCS_MODEL_ARG_MAP.keys())
-ALLOWED_STEM_MODES = {'all', 'isolate'}
-ALLOWED_STEMS = {'vocals', 'drums', 'bass', 'guitar', 'piano', 'other'}
-ALLOWED_MODELS = {
+ALLOWED_STEM_MODES = frozenset({'all', 'isolate'})
+ALLOWED_STEMS = frozenset({'vocals', 'drums', 'bass', 'guitar', 'piano', 'other'})
+ALLOWED_MODELS = frozenset({
     'htdemucs', 'htdemucs_ft', 'htdemucs_6s', 'hdemucs_mmi',
     'mdx', 'mdx_extra', 'mdx_q', 'mdx_extra_q',
-}
-SIX_STEM_MODELS = {'htdemucs_6s'}
-ALLOWED_CLIP_MODES = {'rescale', 'clamp'}
-ALLOWED_SHIFTS = set(range(0, 11))  # 0-10
-ALLOWED_SEGMENTS = {None, 8, 10, 15, 20, 25, 30, 40, 60}
-ALLOWED_OVERLAPS = {None, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5}
+})
+SIX_STEM_MODELS = frozenset({'htdemucs_6s'})
+# Stems only the six-stem models produce
+SIX_STEM_ONLY_STEMS = frozenset({'guitar', 'piano'})
+ALLOWED_CLIP_MODES = frozenset({'rescale', 'clamp'})
+ALLOWED_SHIFTS = frozenset(range(0, 11))  # 0-10
+ALLOWED_SEGMENTS = frozenset({None, 8, 10, 15, 20, 25, 30, 40, 60})
+ALLOWED_OVERLAPS = frozenset({None, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5})
+ALLOWED_DEVICES = frozenset({'auto', 'cpu', 'cuda'})
+# 'inprocess' keeps models loaded in this process; 'cli' spawns `python -m demucs` per job
+DEMUCS_BACKEND = os.environ.get('DEMUCS_BACKEND', 'inprocess').lower()
+# Run in-process CPU inference under bfloat16 autocast (faster on CPUs with bf16 support)
+CPU_BFLOAT16 = os.environ.get('DEMUCS_CPU_BF16', 'false').lower() == 'true'
+# Run in-process GPU inference under bfloat16/float16 autocast (less memory traffic)
+GPU_HALF = os.environ.get('DEMUCS_GPU_HALF', 'false').lower() == 'true'
+# Transformer models cannot use segments longer than they were trained on (7.8s)
+TRANSFORMER_MODELS = frozenset({'htdemucs', 'htdemucs_ft', 'htdemucs_6s'})
+MAX_TRANSFORMER_SEGMENT = 7
+# Default segment (seconds) used on GPU to bound VRAM usage on long tracks
+DEFAULT_GPU_SEGMENT = 7
+# Absolute ffmpeg path, resolved once; subprocess can only posix_spawn (Python 3.13+)
+# executables given with a directory, otherwise it falls back to fork/exec
+FFMPEG_PATH = shutil.which('ffmpeg') or 'ffmpeg'
+# Substrings in demucs output that indicate a CUDA failure worth retrying on CPU
+CUDA_FAILURE_MARKERS = ('CUDA out of memory', 'CUDA error', 'cuDNN error')
 
 
 def validate_job_id(job_id):
     """Validate that job_id contains only safe characters (alphanumeric and hyphens)."""
-    if not job_id or not JOB_ID_PATTERN.match(job_id):
+    if not job_id or not JOB_ID_PATTERN.fullmatch(job_id):
         return False
     return True
 
@@ -73,28 +102,344 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def detect_cuda():
+    """Return True if an NVIDIA GPU is usable by torch.
+
+    The nvidia-smi check is cheap and avoids importing torch on CPU-only hosts.
+    """
+    if not shutil.which('nvidia-smi'):
+        return False
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except Exception as e:
+        logger.warning(f"CUDA detection failed, using CPU: {e}")
+        return False
+
+
+def resolve_device(requested):
+    """Map a requested device ('auto', 'cpu', 'cuda') to the device passed to demucs."""
+    if requested == 'cpu':
+        return 'cpu'
+    if requested == 'cuda' and not HAS_CUDA:
+        logger.warning("CUDA requested but no GPU is available, falling back to CPU")
+    return 'cuda' if HAS_CUDA else 'cpu'
+
+
+def default_segment(model, device):
+    """Pick the demucs --segment value to use when the request does not set one.
+
+    DEMUCS_SEGMENT overrides the default. On GPU, demucs is limited to short
+    segments so peak VRAM stays bounded; on CPU the model's native segment
+    is kept since larger chunks mean less per-chunk overhead.
+    """
+    env_segment = os.environ.get('DEMUCS_SEGMENT', '')
+    segment = None
+    if env_segment:
+        try:
+            segment = int(env_segment)
+        except ValueError:
+            logger.warning(f"Ignoring invalid DEMUCS_SEGMENT value: {env_segment}")
+    if segment is None and device == 'cuda':
+        segment = DEFAULT_GPU_SEGMENT
+    if segment is not None and model in TRANSFORMER_MODELS:
+        segment = min(segment, MAX_TRANSFORMER_SEGMENT)
+    return segment
+
+
+def cpu_thread_count():
+    """Return how many physical cores this process can use.
+
+    Honors the CPU affinity mask and a cgroup v2 CPU quota (docker --cpus),
+    neither of which torch or OpenMP take into account on their own. SMT
+    siblings count once, since demucs gains nothing from hyperthreads.
+    """
+    cores = set()
+    for cpu in os.sched_getaffinity(0):
+        try:
+            with open(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list') as f:
+                cores.add(f.read().strip())
+        except OSError:
+            cores.add(str(cpu))
+    count = len(cores)
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    return max(1, count)
+
+
+def preload_models(models):
+    """Load demucs models into the in-process backend's cache ahead of the first job."""
+    for name in models:
+        if name not in DEMUCS_MODEL_ARG_MAP:
+            logger.warning(f"Ignoring unknown model in PRELOAD_MODELS: {name}")
+            continue
+        try:
+            separator.get_model(DEMUCS_MODEL_ARG_MAP[name])
+            logger.info(f"Preloaded demucs model {name}")
+        except Exception as e:
+            logger.warning(f"Could not preload demucs model {name}: {e}")
+
+
+def open_pidfd(process):
+    """Return a pidfd for a running Popen process, or None where pidfds are unavailable.
+
+    A pidfd becomes readable when the process exits, so a thread can sleep in
+    select() instead of polling like Popen.wait(timeout) does.
+    """
+    if process.returncode is not None:
+        return None
+    try:
+        return os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def wait_process(process, timeout):
+    """Wait up to timeout seconds for process to exit and return its exit code.
+
+    Raises subprocess.TimeoutExpired like Popen.wait.
+    """
+    pidfd = open_pidfd(process)
+    if pidfd is None:
+        return process.wait(timeout=timeout)
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(pidfd, selectors.EVENT_READ)
+            if not selector.select(timeout):
+                raise subprocess.TimeoutExpired(process.args, timeout)
+    finally:
+        os.close(pidfd)
+    return process.wait()
+
+
+def estimate_status(status, started):
+    """Return status with a time-based progress estimate (10% to 85%) if that is further along."""
+    elapsed = time.monotonic() - started
+    time_progress = 10 + min(75, int(elapsed / ESTIMATED_DURATION * 75))
+    if time_progress <= status.get('progress', 0):
+        return status
+    return {
+        **status,
+        'progress': time_progress,
+        'stage': f'Processing audio... ({time_progress}%)',
+        'elapsed': format_elapsed(elapsed)
+    }
+
+
+def is_cuda_failure(output):
+    """Check whether demucs output indicates a CUDA error (e.g. out of memory)."""
+    return any(marker in output for marker in CUDA_FAILURE_MARKERS)
+
+class HashingSpool:
+    """Upload spool file that hashes the bytes written into it.
+
+    Lets the result cache key the upload without reading the file back.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """Request that spools uploaded files straight into UPLOAD_FOLDER.
+
+    Werkzeug's default keeps the first 500 KB of each file in memory and then
+    rolls over to a temporary file in /tmp, which is a different filesystem
+    from the uploads volume in Docker.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = tempfile.NamedTemporaryFile(
+            mode='wb+', dir=UPLOAD_FOLDER, prefix='.upload-', buffering=UPLOAD_BUFFER_SIZE)
+        return HashingSpool(spool) if RESULT_CACHE_ENABLED else spool
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 UPLOAD_FOLDER = '/app/uploads'
 OUTPUT_FOLDER = '/app/outputs'
-ALLOWED_EXTENSIONS = {'mp3', 'wav', 'flac', 'ogg', 'm4a', 'aac'}
-WAV_EXTENSIONS = {'wav'}  # Extensions that support WAV output
+ALLOWED_EXTENSIONS = frozenset({'mp3', 'wav', 'flac', 'ogg', 'm4a', 'aac'})
+WAV_EXTENSIONS = frozenset({'wav'})  # Extensions that support WAV output
+# Copy uploads to disk in 1 MiB blocks (werkzeug's FileStorage.save uses 16 KiB)
+UPLOAD_BUFFER_SIZE = 1 << 20
+# Demucs output is read from its PTY in 64 KiB blocks; only the last 64 KiB is kept
+OUTPUT_READ_SIZE = 1 << 16
+OUTPUT_TAIL_SIZE = 1 << 16
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Content-addressed cache of finished stems, keyed by audio hash and options
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE', 'true').lower() == 'true'
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '50'))
+
+# Number of separations that may run at the same time; further jobs wait queued.
+# Each CLI run loads its own copy of the model, so concurrent uploads would
+# otherwise multiply RAM/VRAM use. Defaults to one model in memory at a time.
+MAX_CONCURRENT_JOBS = max(1, int(os.environ.get('MAX_CONCURRENT_JOBS', '1')))
+
+# Size the OpenMP/MKL thread pools of torch (imported below or in separator) and
+# of CLI demucs runs to the usable physical cores. CLI jobs run side by side in
+# separate processes, so the cores are split between them; in-process jobs
+# share one inference lock. Explicit OMP_NUM_THREADS/MKL_NUM_THREADS win.
+CPU_THREADS = cpu_thread_count()
+if DEMUCS_BACKEND == 'cli':
+    CPU_THREADS = max(1, CPU_THREADS // MAX_CONCURRENT_JOBS)
+os.environ.setdefault('OMP_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(CPU_THREADS))
+
+# Environment for CLI demucs runs, built once after the thread settings above.
+# CPU runs also hide GPUs so torch does not initialize CUDA.
+DEMUCS_ENV = {**os.environ, 'PYTHONUNBUFFERED': '1', 'TERM': 'xterm'}
+DEMUCS_CPU_ENV = {**DEMUCS_ENV, 'CUDA_VISIBLE_DEVICES': ''}
+
+# Detect GPU once at startup; demucs runs on CUDA when available
+HAS_CUDA = detect_cuda()
+logger.info(f"CUDA available: {HAS_CUDA}")
+
+class StatusStore:
+    """Thread-safe job status map with LRU capacity and TTL eviction.
+
+    Entries are dropped once the store exceeds max_entries (least recently
+    written first) or when they have not been updated for ttl seconds.
+    Expired entries are swept during writes, at most every sweep_interval.
+    Queued and processing jobs are never expired, since a job can wait in
+    the queue or separate for longer than ttl without a status write.
+    Every write gets a new store-wide revision number, which /status uses as
+    its ETag.
+    """
+
+    ACTIVE_STATUSES = frozenset({'queued', 'processing'})
+
+    def __init__(self, max_entries=10000, ttl=3600, sweep_interval=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # job_id -> (updated_at, status dict, revision)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._revision = 0
+
+    def __setitem__(self, job_id, status):
+        with self._lock:
+            self._put(job_id, status)
+
+    def __getitem__(self, job_id):
+        with self._lock:
+            return self._entries[job_id][1]
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, job_id, default=None):
+        with self._lock:
+            entry = self._entries.get(job_id)
+        return entry[1] if entry is not None else default
+
+    def get_with_revision(self, job_id):
+        """Return (status, revision) for a job, or (None, None) if unknown."""
+        with self._lock:
+            entry = self._entries.get(job_id)
+        return entry[1:] if entry is not None else (None, None)
+
+    def _put(self, job_id, status):
+        now = time.monotonic()
+        self._revision += 1
+        self._entries[job_id] = (now, status, self._revision)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+
+    def _sweep(self, now):
+        # Entries are ordered by last write, so expired ones are at the front
+        self._last_sweep = now
+        expired = []
+        for job_id, (updated_at, status, _) in self._entries.items():
+            if now - updated_at < self.ttl:
+                break
+            if status.get('status') not in self.ACTIVE_STATUSES:
+                expired.append(job_id)
+        for job_id in expired:
+            del self._entries[job_id]
+
+
 # Track processing progress
-processing_status = {}
+processing_status = StatusStore()
+# Reported for job IDs the processor has no (or no longer has) status for
+UNKNOWN_STATUS = {'status': 'unknown', 'progress': 0}
+
+# Start times of CLI jobs whose progress is estimated from elapsed time
+# between demucs' own progress updates
+estimated_jobs = {}
+# Typical CLI separation time the estimate is scaled to (3-10 minutes in practice)
+ESTIMATED_DURATION = 300
 
 # Track active subprocesses for cancellation
 active_processes = {}
+# Guards active_processes together with the queued/processing/cancelled
+# transitions in processing_status: run_job claims a job and cancel_job
+# removes and marks it while holding this lock
 process_lock = threading.Lock()
 
+# Separations run in the background so /process returns right away and
+# /status stays responsive while demucs works
+job_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix='demucs-job')
+# Jobs waiting for and running on job_executor, reported by /health
+job_counts = {'queued': 0, 'running': 0}
+job_counts_lock = threading.Lock()
+
+def submit_job(run):
+    """Queue run on job_executor, keeping job_counts up to date."""
+    def tracked():
+        with job_counts_lock:
+            job_counts['queued'] -= 1
+            job_counts['running'] += 1
+        try:
+            run()
+        finally:
+            with job_counts_lock:
+                job_counts['running'] -= 1
+
+    with job_counts_lock:
+        job_counts['queued'] += 1
+    job_executor.submit(tracked)
+
+# Leftover demucs output and uploads are removed off the job thread
+cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cleanup')
+
+# Warm the model cache in the background; a job for a model that is still
+# loading waits on the loader instead of loading it a second time
+PRELOAD_MODELS = [name.strip() for name in os.environ.get('PRELOAD_MODELS', '').split(',') if name.strip()]
+if DEMUCS_BACKEND == 'inprocess' and PRELOAD_MODELS:
+    threading.Thread(target=preload_models, args=(PRELOAD_MODELS,), daemon=True).start()
+
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
 
 def is_wav_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in WAV_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in WAV_EXTENSIONS
 
 def convert_to_flac(src_path, dst_path):
     """Convert an audio file to FLAC format using ffmpeg.
@@ -103,11 +448,13 @@ def convert_to_flac(src_path, dst_path):
     On failure a RuntimeError is raised, any partial dst is cleaned up,
     and the source file is kept.
     """
-    ffmpeg_cmd = ['ffmpeg', '-y', '-i', src_path, dst_path]
+    # Only errors are printed, so a successful run produces no output to collect
+    ffmpeg_cmd = [FFMPEG_PATH, '-y', '-loglevel', 'error', '-i', src_path, dst_path]
     logger.info(f"Converting to FLAC: {' '.join(ffmpeg_cmd)}")
     try:
         result = subprocess.run(
-            ffmpeg_cmd, capture_output=True, text=True, timeout=600
+            ffmpeg_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, timeout=600
         )
     except subprocess.TimeoutExpired:
         # Clean up partial output
@@ -118,24 +465,195 @@ def convert_to_flac(src_path, dst_path):
         # Clean up partial output
         if os.path.exists(dst_path):
             os.remove(dst_path)
-        logger.error(f"FLAC conversion failed: {result.stderr}")
+        logger.error(f"FLAC conversion failed: {result.stderr.decode('utf-8', errors='replace')}")
         raise RuntimeError(f"FLAC conversion failed for {src_path}")
     # Conversion succeeded – clean up the intermediate file
     if os.path.exists(src_path):
         os.remove(src_path)
 
+def format_elapsed(seconds):
+    """Format elapsed time as Xm Ys"""
+    mins, secs = divmod(int(seconds), 60)
+    return f"{mins}m {secs}s" if mins > 0 else f"{secs}s"
+
+def result_cache_dir():
+    return os.path.join(OUTPUT_FOLDER, '.cache')
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file."""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def upload_digest(file, path):
+    """Return the SHA-256 hex digest of an upload saved at path.
+
+    Uses the hash computed while the upload was spooled when there is one.
+    """
+    sha256 = getattr(file.stream, 'sha256', None)
+    return sha256.hexdigest() if sha256 is not None else file_digest(path)
+
+def result_cache_key(digest, *options):
+    """Build a cache key from the audio digest and every option that affects the output."""
+    return hashlib.sha256('|'.join([digest, *map(str, options)]).encode()).hexdigest()
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst, copying instead if linking is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def cleanup_job_files(demucs_output, model_dir, input_path):
+    """Remove a finished job's demucs output directory and its uploaded input."""
+    shutil.rmtree(demucs_output, ignore_errors=True)
+    try:
+        # Only succeeds once no other job has output under the model directory
+        os.rmdir(model_dir)
+    except OSError:
+        pass
+    try:
+        os.remove(input_path)
+        logger.info(f"Cleaned up input file: {input_path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove input file {input_path}: {e}")
+
+def list_stem_files(directory):
+    """Return {filename: path} for the files in a demucs output directory."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry.path for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+def copy_file_in_kernel(src, dst):
+    """Copy src to dst with copy_file_range(2), falling back to shutil.copyfile.
+
+    copy_file_range keeps the data in the kernel and can share extents on
+    filesystems that support reflinks; shutil.copyfile uses sendfile on Linux.
+    """
+    if hasattr(os, 'copy_file_range'):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                return
+            except OSError as e:
+                # Unsupported between these filesystems or by this kernel
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+    shutil.copyfile(src, dst)
+
+def move_fast(src, dst):
+    """Move src to dst with a rename, copying only when they are on different filesystems.
+
+    os.replace is a single rename(2) that also overwrites an existing dst.
+    The cross-device fallback copies in the kernel without passing the data
+    through Python.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file_in_kernel(src, dst)
+        os.unlink(src)
+
+def save_upload(file, path):
+    """Save an uploaded FileStorage to path and return its size in bytes.
+
+    UploadRequest already spooled the upload into UPLOAD_FOLDER, so the spool
+    file is hard-linked into place instead of copied; the spool's own name is
+    unlinked when the request closes it. Other streams are copied.
+    """
+    stream = file.stream
+    spool_name = getattr(stream, 'name', None)
+    if isinstance(spool_name, str):
+        stream.flush()
+        try:
+            os.link(spool_name, path)
+            return os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"Could not link upload spool {spool_name}, copying instead: {e}")
+    stream.seek(0)
+    with open(path, 'wb', buffering=UPLOAD_BUFFER_SIZE) as out:
+        shutil.copyfileobj(stream, out, length=UPLOAD_BUFFER_SIZE)
+        return out.tell()
+
+def load_cached_result(key, job_output_dir, name_prefix):
+    """Link cached stems into job_output_dir and return {stem: path}, or None on a miss."""
+    entry_dir = safe_join(result_cache_dir(), key)
+    try:
+        names = os.listdir(entry_dir)
+    except FileNotFoundError:
+        return None
+    output_files = {}
+    for name in names:
+        stem = name.rsplit('.', 1)[0]
+        dst = safe_join(job_output_dir, f"{name_prefix}{name}")
+        link_or_copy(safe_join(entry_dir, name), dst)
+        output_files[stem] = dst
+    # Touch the entry so pruning evicts the least recently used results first
+    os.utime(entry_dir)
+    return output_files or None
+
+def store_cached_result(key, output_files):
+    """Add finished stems to the result cache, then prune the oldest entries."""
+    cache_dir = result_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = safe_join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+    # Populate a temporary directory and rename it so readers never see a partial entry
+    tmp_dir = tempfile.mkdtemp(prefix='tmp-', dir=cache_dir)
+    try:
+        for stem, path in output_files.items():
+            ext = path.rsplit('.', 1)[1]
+            link_or_copy(path, os.path.join(tmp_dir, f"{stem}.{ext}"))
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    prune_result_cache(cache_dir)
+
+def prune_result_cache(cache_dir):
+    """Keep at most RESULT_CACHE_MAX_ENTRIES entries, evicting the least recently used."""
+    entries = [e for e in os.scandir(cache_dir) if e.is_dir() and not e.name.startswith('tmp-')]
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - RESULT_CACHE_MAX_ENTRIES)]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ok'})
+    with job_counts_lock:
+        jobs = dict(job_counts)
+    return jsonify({'status': 'ok', 'jobs': jobs, 'max_concurrent_jobs': MAX_CONCURRENT_JOBS})
 
 @app.route('/status/<job_id>', methods=['GET'])
 def get_status(job_id):
     """Get processing status for a job"""
     if not validate_job_id(job_id):
         return jsonify({'error': 'Invalid job ID'}), 400
-    if job_id in processing_status:
-        return jsonify(processing_status[job_id])
-    return jsonify({'status': 'unknown', 'progress': 0})
+    status, revision = processing_status.get_with_revision(job_id)
+    if status is None:
+        return jsonify(UNKNOWN_STATUS)
+    started = estimated_jobs.get(job_id)
+    if started is not None and status.get('status') == 'processing':
+        # The estimate moves with the clock, not with writes; no ETag for it
+        return jsonify(estimate_status(status, started))
+    # Pollers send back the revision they last saw; unchanged jobs get a bodiless 304
+    etag = str(revision)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(status)
+    response.set_etag(etag)
+    return response
 
 @app.route('/cancel/<job_id>', methods=['POST'])
 def cancel_job(job_id):
@@ -145,58 +663,50 @@ def cancel_job(job_id):
     logger.info(f"Cancel request received for job: {job_id}")
     
     with process_lock:
-        if job_id in active_processes:
-            proc_info = active_processes[job_id]
-            process = proc_info.get('process')
-            stop_event = proc_info.get('stop_event')
-            master_fd = proc_info.get('master_fd')
+        proc_info = active_processes.pop(job_id, None)
+        if proc_info is None:
+            status = processing_status.get(job_id)
+            if status is not None and status.get('status') == 'queued':
+                # Not started yet; run_job sees the status and skips the job
+                processing_status[job_id] = {'status': 'cancelled', 'progress': 0, 'stage': 'Cancelled by user'}
+                logger.info(f"Cancelled queued job {job_id}")
+                return jsonify({'status': 'cancelled', 'job_id': job_id})
             
-            if stop_event:
-                stop_event.set()
-            
-            # Close PTY master fd first
-            if master_fd:
-                try:
-                    os.close(master_fd)
-                except OSError:
-                    pass
-            
-            if process and process.poll() is None:  # Still running
-                logger.info(f"Killing process for job {job_id}")
-                try:
-                    process.terminate()
-                    # Give it a moment to terminate gracefully
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        process.kill()  # Force kill if it doesn't stop
-                    logger.info(f"Process for job {job_id} terminated")
-                except Exception as e:
-                    logger.error(f"Error killing process: {e}")
-            
-            # Clean up
-            del active_processes[job_id]
-            processing_status[job_id] = {'status': 'cancelled', 'progress': 0, 'stage': 'Cancelled by user'}
-            
-            # Clean up any partial files
-            job_output_dir = safe_join(OUTPUT_FOLDER, job_id)
-            if os.path.exists(job_output_dir):
-                try:
-                    shutil.rmtree(job_output_dir)
-                    logger.info(f"Cleaned up output directory for cancelled job {job_id}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up output dir: {e}")
-            
-            return jsonify({'status': 'cancelled', 'job_id': job_id})
-        else:
             logger.info(f"No active process found for job {job_id}")
             return jsonify({'status': 'not_found', 'job_id': job_id}), 404
+        
+        # Stop and mark the job together with removing it, so the job thread
+        # sees a set stop event whenever its entry is gone and does not report
+        # progress or a failure over the cancelled status.
+        process = proc_info.get('process')
+        stop_event = proc_info.get('stop_event')
+        if stop_event:
+            stop_event.set()
+        processing_status[job_id] = {'status': 'cancelled', 'progress': 0, 'stage': 'Cancelled by user'}
+    
+    # The job is no longer in active_processes, so the kill can wait without the lock
+    if process and process.poll() is None:  # Still running
+        logger.info(f"Killing process for job {job_id}")
+        try:
+            process.terminate()
+            # Give it a moment to terminate gracefully
+            try:
+                wait_process(process, 5)
+            except subprocess.TimeoutExpired:
+                process.kill()  # Force kill if it doesn't stop
+            logger.info(f"Process for job {job_id} terminated")
+        except Exception as e:
+            logger.error(f"Error killing process: {e}")
+    
+    # The job thread removes the job's files once it sees the stop event;
+    # deleting them here could pull them out from under a job collecting stems
+    return jsonify({'status': 'cancelled', 'job_id': job_id})
 
 @app.route('/process', methods=['POST'])
 def process_audio():
     logger.info("=== Starting new processing request ===")
     job_id = None
-    start_time = time.time()  # Track processing time
+    start_time = time.monotonic()  # Track processing time
     
     try:
         if 'file' not in request.files:
@@ -217,6 +727,7 @@ def process_audio():
             }), 400
         safe_model = DEMUCS_MODEL_ARG_MAP[model]
         clip_mode = request.form.get('clip_mode', 'rescale').lower()  # rescale or clamp
+        requested_device = request.form.get('device', 'auto').lower()  # auto, cpu or cuda
         
         # Parse numeric options – reject non-parseable values with 400
         shifts_raw = request.form.get('shifts')
@@ -269,7 +780,7 @@ def process_audio():
             return jsonify({'error': 'Invalid model'}), 400
         
         # Ensure isolate_stem is compatible with the selected model
-        if model not in SIX_STEM_MODELS and isolate_stem in {'guitar', 'piano'}:
+        if model not in SIX_STEM_MODELS and isolate_stem in SIX_STEM_ONLY_STEMS:
             logger.error(f"Incompatible isolate stem '{isolate_stem}' for model '{model}'")
             return jsonify({'error': 'Incompatible isolate_stem for selected model'}), 400
         
@@ -277,6 +788,10 @@ def process_audio():
             logger.error(f"Invalid clip mode: {clip_mode}")
             return jsonify({'error': 'Invalid clip mode'}), 400
         
+        if requested_device not in ALLOWED_DEVICES:
+            logger.error(f"Invalid device: {requested_device}")
+            return jsonify({'error': 'Invalid device'}), 400
+        
         if shifts not in ALLOWED_SHIFTS:
             logger.error(f"Invalid shifts value: {shifts}")
             return jsonify({'error': 'Invalid shifts value'}), 400
@@ -289,8 +804,11 @@ def process_audio():
             logger.error(f"Invalid overlap value: {overlap}")
             return jsonify({'error': 'Invalid overlap value'}), 400
         
+        device = resolve_device(requested_device)
+        if segment is None:
+            segment = default_segment(model, device)
         segment_str = f'{segment}s' if segment is not None else 'default'
-        logger.info(f"Job ID: {job_id}, File: {file.filename}, Model: {model}, Format: {output_format}, Mode: {stem_mode}, Isolate: {isolate_stem}, Segment: {segment_str}, Overlap: {overlap}, Shifts: {shifts}, Clip: {clip_mode}")
+        logger.info(f"Job ID: {job_id}, File: {file.filename}, Model: {model}, Format: {output_format}, Mode: {stem_mode}, Isolate: {isolate_stem}, Segment: {segment_str}, Overlap: {overlap}, Shifts: {shifts}, Clip: {clip_mode}, Device: {device}")
         
         # Initialize status
         processing_status[job_id] = {'status': 'uploading', 'progress': 5, 'stage': 'Receiving file'}
@@ -304,12 +822,14 @@ def process_audio():
             return jsonify({'error': 'File type not allowed'}), 400
         
         # Determine output format
-        # For demucs: use WAV output when user requests wav or flac (flac converted after)
-        # Use MP3 output when user requests mp3
+        # For demucs: use MP3 output when user requests mp3 and WAV for wav.
+        # The in-process backend writes FLAC directly; the CLI can only write
+        # MP3 or WAV, so its WAV stems are converted to FLAC afterwards.
         if output_format == 'mp3':
             demucs_output_fmt = 'mp3'
+        elif output_format == 'flac' and DEMUCS_BACKEND == 'inprocess':
+            demucs_output_fmt = 'flac'
         else:
-            # WAV and FLAC both use WAV from demucs; FLAC is converted afterwards
             demucs_output_fmt = 'wav'
         actual_output_format = output_format
         logger.info(f"Requested format: {output_format}, Demucs output: {demucs_output_fmt}")
@@ -323,455 +843,447 @@ def process_audio():
         else:
             original_filename = filename
         
-        input_path = safe_join(UPLOAD_FOLDER, f"{job_id}_{original_filename}")
+        # Derived names and paths, computed once for the whole job
+        input_name = f"{job_id}_{original_filename}"
+        input_path = safe_join(UPLOAD_FOLDER, input_name)
+        original_name_no_ext = original_filename.rpartition('.')[0] or original_filename
+        # Stems are saved as {original name}_t2s_{stem}.{format}
+        output_prefix = f"{original_name_no_ext}_t2s_"
+        # Demucs writes stems to OUTPUT_FOLDER/{model}/{input name without extension}/
+        model_output_dir = safe_join(OUTPUT_FOLDER, safe_model)
+        demucs_output = safe_join(model_output_dir, input_name.rpartition('.')[0] or input_name)
         logger.info(f"Saving file to: {input_path}")
         logger.info(f"Original filename: {original_filename}")
-        file.save(input_path)
-        
-        file_size = os.path.getsize(input_path)
+        file_size = save_upload(file, input_path)
         logger.info(f"File saved successfully. Size: {file_size / (1024*1024):.2f} MB")
         
         processing_status[job_id] = {'status': 'processing', 'progress': 10, 'stage': f'File saved ({original_filename}), starting separation with {model}'}
         
         # Create output directory for this job
         job_output_dir = safe_join(OUTPUT_FOLDER, job_id)
-        os.makedirs(job_output_dir, exist_ok=True)
+        # OUTPUT_FOLDER exists from startup, so a single mkdir is enough
+        try:
+            os.mkdir(job_output_dir)
+        except FileExistsError:
+            pass
         logger.info(f"Output directory created: {job_output_dir}")
         
-        # Run Demucs separation
-        processing_status[job_id] = {'status': 'processing', 'progress': 15, 'stage': f'Loading AI model ({safe_model})'}
-        expected_stems = ['vocals', 'drums', 'bass', 'guitar', 'piano', 'other'] if model in SIX_STEM_MODELS else ['vocals', 'drums', 'bass', 'other']
-        logger.info(f"Starting Demucs separation: file='{original_filename}', model={safe_model}, segment={segment_str}, stems=[{', '.join(expected_stems)}]")
-        
-        cmd = [
-            'python', '-m', 'demucs',
-            '-o', OUTPUT_FOLDER,
-            '-n', safe_model,
-        ]
-        
-        # Add format-specific options
-        if demucs_output_fmt == 'mp3':
-            cmd.extend([
-                '--mp3',
-                '--mp3-bitrate', '320',  # Highest quality MP3 (320 kbps)
-            ])
-        # For WAV/FLAC output, demucs outputs WAV by default (no --mp3 flag)
-        
-        # Add clip mode
-        if clip_mode == 'clamp':
-            cmd.extend(['--clip-mode', 'clamp'])
-        
-        # Add shifts (shift trick for better quality, N times slower)
-        if shifts > 0:
-            cmd.extend(['--shifts', str(shifts)])
-        
-        # Add segment size (for memory management)
-        if segment is not None:
-            cmd.extend(['--segment', str(segment)])
-        
-        # Add overlap
-        if overlap is not None:
-            cmd.extend(['--overlap', str(overlap)])
-        
-        cmd.append(input_path)
-        
-        logger.info(f"Running command: {' '.join(cmd)}")
-        processing_status[job_id] = {'status': 'processing', 'progress': 10, 'stage': f'Starting AI separation of {original_filename} ({safe_model}, segment {segment_str})...'}
-        
-        # Use PTY to capture tqdm progress output (tqdm uses \r for updates)
-        # PTY makes demucs think it's writing to a terminal, so we get real-time updates
-        master_fd, slave_fd = pty.openpty()
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=slave_fd,
-            stderr=slave_fd,
-            close_fds=True,
-            env={**os.environ, 'CUDA_VISIBLE_DEVICES': '', 'PYTHONUNBUFFERED': '1', 'TERM': 'xterm'}
-        )
-        
-        # Close slave FD in parent process
-        os.close(slave_fd)
-        
-        # Store process reference for cancellation
-        stop_threads = threading.Event()
-        with process_lock:
-            active_processes[job_id] = {
-                'process': process,
-                'stop_event': stop_threads,
-                'master_fd': master_fd
-            }
+        # Reuse stems from an earlier job with identical audio and options
+        cache_key = None
+        if RESULT_CACHE_ENABLED:
+            # The backend and precision switches change the stems too, and the
+            # cache outlives the settings they were produced under
+            cache_key = result_cache_key(
+                upload_digest(file, input_path), model, actual_output_format, stem_mode,
+                isolate_stem, shifts, segment, overlap, clip_mode,
+                DEMUCS_BACKEND, CPU_BFLOAT16, GPU_HALF)
+            cached_outputs = load_cached_result(cache_key, job_output_dir, output_prefix)
+            if cached_outputs:
+                os.remove(input_path)
+                time_str = format_elapsed(time.monotonic() - start_time)
+                processing_status[job_id] = {
+                    'status': 'completed',
+                    'progress': 100,
+                    'stage': 'Complete!',
+                    'elapsed': time_str,
+                    'total_time': time_str,
+                    'job_id': job_id,
+                    'outputs': cached_outputs,
+                    'format': actual_output_format,
+                    'processing_time': time_str
+                }
+                logger.info(f"=== Job {job_id} served from result cache: file='{original_filename}', model={model}, stems={len(cached_outputs)} ===")
+                return jsonify({
+                    'status': 'completed',
+                    'job_id': job_id,
+                    'outputs': cached_outputs,
+                    'format': actual_output_format,
+                    'processing_time': time_str,
+                    'cached': True
+                })
         
-        # Tracking variables
-        output_lines = []
-        last_progress = 10
-        progress_lock = threading.Lock()
-        
-        def format_elapsed(seconds):
-            """Format elapsed time as Xm Ys"""
-            mins = int(seconds // 60)
-            secs = int(seconds % 60)
-            return f"{mins}m {secs}s" if mins > 0 else f"{secs}s"
-        
-        def update_progress(new_progress, stage_msg):
-            """Thread-safe progress update"""
-            nonlocal last_progress
-            with progress_lock:
-                if new_progress > last_progress:
-                    last_progress = new_progress
-                    elapsed = time.time() - start_time
-                    processing_status[job_id] = {
-                        'status': 'processing',
-                        'progress': new_progress,
-                        'stage': stage_msg,
-                        'elapsed': format_elapsed(elapsed)
-                    }
-                    logger.info(f"Progress: {new_progress}% - {stage_msg}")
-        
-        # Regex patterns for tqdm output
-        progress_pattern = re.compile(r'(\d+)%\|')
-        fraction_pattern = re.compile(r'(\d+)/(\d+)')
-        
-        def read_output():
-            """Read PTY output and parse progress"""
-            buffer = ""
+        # Separation runs on the job executor so this request returns right away
+        def run_job():
+            """Separate the saved upload and record the outcome in processing_status."""
+            stop_event = threading.Event()
             
-            while not stop_threads.is_set():
-                try:
-                    # Use select to check if data is available (with timeout)
-                    ready, _, _ = select.select([master_fd], [], [], 0.5)
-                    
-                    if not ready:
-                        # Check if process has ended
-                        if process.poll() is not None:
-                            break
-                        continue
-                    
-                    # Read available data
-                    try:
-                        chunk = os.read(master_fd, 4096).decode('utf-8', errors='replace')
-                    except OSError:
-                        break
-                    
-                    if not chunk:
-                        break
+            def report(status):
+                """Record a status for the job unless it has been cancelled."""
+                with process_lock:
+                    if not stop_event.is_set():
+                        processing_status[job_id] = status
+            
+            def discard_cancelled():
+                """Remove the upload and everything the cancelled job wrote."""
+                logger.info(f"Job {job_id} was cancelled, removing its files")
+                shutil.rmtree(job_output_dir, ignore_errors=True)
+                cleanup_job_files(demucs_output, model_output_dir, input_path)
+            
+            try:
+                # Claim the job under the lock cancel_job takes: a cancel either lands
+                # while the job is still queued, or finds it in active_processes
+                with process_lock:
+                    # A job without a status was dropped from processing_status;
+                    # nothing could report its outcome, so it is not run either
+                    status = processing_status.get(job_id)
+                    cancelled = status is None or status.get('status') == 'cancelled'
+                    if not cancelled:
+                        # Progress estimates and elapsed times leave out time spent queued
+                        job_started = time.monotonic()
+                        active_processes[job_id] = {'process': None, 'stop_event': stop_event}
+                        processing_status[job_id] = {'status': 'processing', 'progress': 15, 'stage': f'Loading AI model ({safe_model})'}
+                if cancelled:
+                    logger.info(f"Job {job_id} was cancelled or lost its status before it started")
+                    discard_cancelled()
+                    return
+                
+                # Run Demucs separation
+                expected_stems = ['vocals', 'drums', 'bass', 'guitar', 'piano', 'other'] if model in SIX_STEM_MODELS else ['vocals', 'drums', 'bass', 'other']
+                logger.info(f"Starting Demucs separation: file='{original_filename}', model={safe_model}, segment={segment_str}, stems=[{', '.join(expected_stems)}]")
+                
+                # An absolute interpreter path lets subprocess use posix_spawn (see FFMPEG_PATH);
+                # it is also the interpreter this app runs in
+                cmd = [
+                    sys.executable, '-m', 'demucs',
+                    '-o', OUTPUT_FOLDER,
+                    '-n', safe_model,
+                ]
+                
+                # Add format-specific options
+                if demucs_output_fmt == 'mp3':
+                    cmd.extend([
+                        '--mp3',
+                        '--mp3-bitrate', '320',  # Highest quality MP3 (320 kbps)
+                    ])
+                # For WAV/FLAC output, demucs outputs WAV by default (no --mp3 flag)
+                
+                # Add clip mode
+                if clip_mode == 'clamp':
+                    cmd.extend(['--clip-mode', 'clamp'])
+                
+                # Add shifts (shift trick for better quality, N times slower)
+                if shifts > 0:
+                    cmd.extend(['--shifts', str(shifts)])
+                
+                # Add segment size (for memory management)
+                if segment is not None:
+                    cmd.extend(['--segment', str(segment)])
+                
+                # Add overlap
+                if overlap is not None:
+                    cmd.extend(['--overlap', str(overlap)])
+                
+                # Isolate mode: demucs writes the stem plus the sum of the others (no_{stem})
+                if stem_mode == 'isolate':
+                    cmd.extend(['--two-stems', isolate_stem])
+                
+                def run_demucs(run_device):
+                    """Run demucs on the given device and return (return_code, output)."""
+                    run_cmd = cmd + ['-d', run_device, input_path]
+                
+                    logger.info(f"Running command: {' '.join(run_cmd)}")
+                    report({'status': 'processing', 'progress': 10, 'stage': f'Starting AI separation of {original_filename} ({safe_model}, segment {segment_str})...'})
+                
+                    # Use PTY to capture tqdm progress output (tqdm uses \r for updates)
+                    # PTY makes demucs think it's writing to a terminal, so we get real-time updates
+                    master_fd, slave_fd = pty.openpty()
+                
+                    env = DEMUCS_CPU_ENV if run_device == 'cpu' else DEMUCS_ENV
+                
+                    process = subprocess.Popen(
+                        run_cmd,
+                        stdout=slave_fd,
+                        stderr=slave_fd,
+                        close_fds=True,
+                        env=env
+                    )
+                
+                    # Close slave FD in parent process
+                    os.close(slave_fd)
+                
+                    # Store process reference for cancellation; a cancel that came in
+                    # while demucs was starting found no process to kill
+                    with process_lock:
+                        if stop_event.is_set():
+                            process.kill()
+                        else:
+                            active_processes[job_id]['process'] = process
+                
+                    # Tracking variables; only the tail of the demucs output is kept, for error reporting
+                    output_tail = deque()
+                    output_tail_size = 0
+                    last_progress = 10
                     
-                    buffer += chunk
+                    def update_progress(new_progress, stage_msg):
+                        """Record demucs' progress when it moves forward"""
+                        nonlocal last_progress
+                        if new_progress > last_progress and not stop_event.is_set():
+                            last_progress = new_progress
+                            elapsed = time.monotonic() - job_started
+                            report({
+                                'status': 'processing',
+                                'progress': new_progress,
+                                'stage': stage_msg,
+                                'elapsed': format_elapsed(elapsed)
+                            })
+                            logger.info(f"Progress: {new_progress}% - {stage_msg}")
+                
+                    last_pct = -1
                     
-                    # Process buffer - split by \r or \n to handle tqdm updates
-                    while '\r' in buffer or '\n' in buffer:
-                        # Find first delimiter
-                        r_idx = buffer.find('\r')
-                        n_idx = buffer.find('\n')
-                        
-                        if r_idx != -1 and (n_idx == -1 or r_idx < n_idx):
-                            line, buffer = buffer[:r_idx], buffer[r_idx+1:]
-                        else:
-                            line, buffer = buffer[:n_idx], buffer[n_idx+1:]
-                        
-                        line = line.strip()
-                        if not line:
-                            continue
+                    def handle_output(chunk):
+                        """Keep the tail of demucs output and parse tqdm progress from a block"""
+                        nonlocal output_tail_size, last_pct
                         
-                        # Remove ANSI escape codes for cleaner logging
-                        clean_line = re.sub(r'\x1b\[[0-9;]*[mK]', '', line)
-                        if clean_line:
-                            output_lines.append(clean_line)
-                            logger.info(f"[Demucs] {clean_line}")
+                        # Keep roughly the last OUTPUT_TAIL_SIZE bytes
+                        output_tail.append(chunk)
+                        output_tail_size += len(chunk)
+                        while output_tail_size - len(output_tail[0]) >= OUTPUT_TAIL_SIZE:
+                            output_tail_size -= len(output_tail.popleft())
                         
-                        # Parse progress from tqdm output
-                        progress_match = progress_pattern.search(line)
-                        if progress_match:
-                            try:
-                                pct = int(progress_match.group(1))
+                        # tqdm redraws its bar with \r; only the latest update in the block matters
+                        idx = chunk.rfind(b'%|')
+                        if idx != -1:
+                            progress_match = PROGRESS_PATTERN.search(chunk, max(0, idx - 3), idx + 2)
+                            pct = int(progress_match.group(1)) if progress_match else last_pct
+                            # tqdm redraws many times per percent; skip repeats
+                            if pct != last_pct:
+                                last_pct = pct
                                 # Map demucs 0-100% to our 10-90%
                                 mapped = 10 + int(pct * 0.80)
                                 update_progress(mapped, f'Separating stems from {original_filename} [{model}]... ({mapped}%)')
-                            except (ValueError, IndexError):
-                                pass
                         else:
-                            # Check for model loading messages
-                            lower_line = line.lower()
-                            if 'loading' in lower_line or 'downloading' in lower_line:
+                            if b'Downloading' in chunk:
                                 update_progress(12, 'Loading AI model...')
-                            elif 'separating' in lower_line:
-                                frac_match = fraction_pattern.search(line)
-                                if frac_match:
-                                    try:
-                                        curr, total = int(frac_match.group(1)), int(frac_match.group(2))
-                                        if total > 0:
-                                            pct = int((curr / total) * 100)
-                                            mapped = 10 + int(pct * 0.80)
-                                            update_progress(mapped, f'Processing track {curr}/{total}... ({mapped}%)')
-                                    except (ValueError, IndexError):
-                                        pass
-                                        
-                except Exception as e:
-                    logger.warning(f"Error reading output: {e}")
-                    break
-            
-            # Process any remaining buffer
-            if buffer.strip():
-                clean = re.sub(r'\x1b\[[0-9;]*[mK]', '', buffer.strip())
-                if clean:
-                    output_lines.append(clean)
-                    logger.info(f"[Demucs] {clean}")
-        
-        def estimate_progress():
-            """Time-based progress estimation - updates immediately, then every 2 seconds"""
-            # Typical processing: 3-10 minutes depending on file size
-            estimated_duration = 300  # 5 minute baseline
-            
-            # Update immediately on first run, then every 2 seconds
-            while not stop_threads.is_set():
-                elapsed = time.time() - start_time
-                
-                # Calculate time-based progress (10% to 85%)
-                time_progress = 10 + min(75, int((elapsed / estimated_duration) * 75))
+                            # Log demucs' own messages (model, output paths); tqdm redraws are not logged
+                            text = ANSI_ESCAPE_PATTERN.sub('', chunk.decode('utf-8', errors='replace')).strip()
+                            if text:
+                                logger.info(f"[Demucs] {text}")
+                    
+                    # Between tqdm updates /status fills in a time-based estimate
+                    estimated_jobs[job_id] = job_started
+                    
+                    deadline = time.monotonic() + 1800  # 30 min timeout
+                    # Wake up when demucs exits even if something else keeps the PTY open;
+                    # without a pidfd, fall back to checking every half second
+                    pidfd = open_pidfd(process)
+                    with selectors.DefaultSelector() as selector:
+                        selector.register(master_fd, selectors.EVENT_READ)
+                        if pidfd is not None:
+                            selector.register(pidfd, selectors.EVENT_READ)
+                        while not stop_event.is_set() and time.monotonic() < deadline:
+                            timeout = deadline - time.monotonic() if pidfd is not None else 0.5
+                            ready = {key.fd for key, _ in selector.select(timeout=timeout)}
+                            if master_fd not in ready:
+                                # Check if process has ended
+                                if pidfd in ready or process.poll() is not None:
+                                    break
+                                continue
+                            try:
+                                chunk = os.read(master_fd, OUTPUT_READ_SIZE)
+                            except OSError:
+                                # EIO once demucs exits and the PTY slave is closed
+                                break
+                            if not chunk:
+                                break
+                            handle_output(chunk)
+                    
+                    # Output is done; wait for the exit status within what is left of the timeout
+                    if pidfd is not None:
+                        os.close(pidfd)
+                    try:
+                        return_code = wait_process(process, max(1, deadline - time.monotonic()))
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+                        with process_lock:
+                            active_processes.pop(job_id, None)
+                        raise subprocess.TimeoutExpired(run_cmd, 1800)
+                    finally:
+                        estimated_jobs.pop(job_id, None)
+                        os.close(master_fd)
+                        
+                    output = b''.join(output_tail).decode('utf-8', errors='replace')
+                    return return_code, ANSI_ESCAPE_PATTERN.sub('', output)
                 
-                with progress_lock:
-                    current = last_progress
-                    status = processing_status.get(job_id, {})
+                def run_inprocess(run_device):
+                    """Separate with a model kept loaded in this process and return (return_code, output)."""
+                    report({'status': 'processing', 'progress': 10, 'stage': f'Starting AI separation of {original_filename} ({safe_model}, segment {segment_str})...'})
                     
-                    # Only update if time-based is higher and we're still processing
-                    if (time_progress > current and 
-                        status.get('status') == 'processing' and
-                        current < 85):
-                        processing_status[job_id] = {
+                    def on_progress(fraction):
+                        if stop_event.is_set():
+                            return
+                        mapped = 10 + int(fraction * 80)
+                        report({
                             'status': 'processing',
-                            'progress': time_progress,
-                            'stage': f'Processing audio... ({time_progress}%)',
-                            'elapsed': format_elapsed(elapsed)
-                        }
-                
-                # Sleep after update (so first update is immediate)
-                for _ in range(4):  # 4 x 0.5s = 2s, but check stop_threads frequently
-                    if stop_threads.is_set():
-                        break
-                    time.sleep(0.5)
-        
-        # Start both threads
-        output_thread = threading.Thread(target=read_output, daemon=True)
-        estimation_thread = threading.Thread(target=estimate_progress, daemon=True)
-        output_thread.start()
-        estimation_thread.start()
-        
-        logger.info(f"Started output reader and progress estimator for job {job_id}")
-        
-        # Wait for process to complete
-        try:
-            return_code = process.wait(timeout=1800)  # 30 min timeout
-        except subprocess.TimeoutExpired:
-            process.kill()
-            stop_threads.set()
-            try:
-                os.close(master_fd)
-            except OSError:
-                pass
-            output_thread.join(timeout=5)
-            estimation_thread.join(timeout=2)
-            with process_lock:
-                if job_id in active_processes:
-                    del active_processes[job_id]
-            raise subprocess.TimeoutExpired(cmd, 1800)
-        
-        # Signal threads to stop and clean up
-        stop_threads.set()
-        try:
-            os.close(master_fd)
-        except OSError:
-            pass
-        output_thread.join(timeout=10)
-        estimation_thread.join(timeout=2)
-        
-        full_output = '\n'.join(output_lines)
-        
-        if return_code != 0:
-            logger.error(f"Demucs failed with return code {return_code}")
-            logger.error(f"Output: {full_output}")
-            processing_status[job_id] = {'status': 'failed', 'progress': 0, 'stage': 'Processing failed'}
-            # Clean up from active_processes
-            with process_lock:
-                if job_id in active_processes:
-                    del active_processes[job_id]
-            return jsonify({
-                'error': 'Processing failed',
-                'details': full_output
-            }), 500
-        
-        elapsed = time.time() - start_time
-        processing_status[job_id] = {'status': 'processing', 'progress': 90, 'stage': f'AI separation of {original_filename} complete, organizing files...', 'elapsed': format_elapsed(elapsed)}
-        logger.info(f"Demucs completed successfully for '{original_filename}' (model={model}, segment={segment_str}), organizing output files...")
-        
-        # Demucs creates: OUTPUT_FOLDER/{model}/filename_without_ext/stem.mp3 (or .wav)
-        # Use the original filename with job_id prefix consistently
-        filename_no_ext = os.path.splitext(f"{job_id}_{original_filename}")[0]
-        demucs_output = safe_join(OUTPUT_FOLDER, model, filename_no_ext)
-        
-        logger.info(f"Looking for output in: {demucs_output}")
-        
-        if not os.path.exists(demucs_output):
-            # Try alternate paths for the model
-            alt_path = safe_join(OUTPUT_FOLDER, model, os.path.splitext(filename)[0])
-            logger.info(f"Trying alternate path: {alt_path}")
-            if os.path.exists(alt_path):
-                demucs_output = alt_path
-            else:
-                # List what's actually there
-                model_dir = safe_join(OUTPUT_FOLDER, model)
-                if os.path.exists(model_dir):
-                    contents = os.listdir(model_dir)
-                    logger.info(f"Contents of {model} dir: {contents}")
-                    if contents:
-                        demucs_output = safe_join(model_dir, contents[0])
-                        logger.info(f"Using first directory: {demucs_output}")
-        
-        # Move files to job output directory and collect paths
-        output_files = {}
-        # Determine available stems based on model
-        if model in SIX_STEM_MODELS:
-            all_stems = ['vocals', 'drums', 'bass', 'guitar', 'piano', 'other']
-        else:
-            all_stems = ['vocals', 'drums', 'bass', 'other']
-        demucs_ext = 'wav' if demucs_output_fmt == 'wav' else 'mp3'
-        
-        # Get original filename without extension for naming output files
-        original_name_no_ext = os.path.splitext(original_filename)[0]
-        
-        if stem_mode == 'isolate':
-            # Isolate mode: output the isolated stem + combined "other" track
-            logger.info(f"Isolate mode: extracting {isolate_stem} and combining the rest")
-            
-            # First, get the isolated stem
-            logger.info(f"[Stem] Processing isolated stem: {isolate_stem}")
-            for ext in [demucs_ext, 'mp3', 'wav']:
-                src = safe_join(demucs_output, f"{isolate_stem}.{ext}")
-                if os.path.exists(src):
-                    if actual_output_format == 'flac':
-                        dst_filename = f"{original_name_no_ext}_t2s_{isolate_stem}.flac"
-                        dst = safe_join(job_output_dir, dst_filename)
+                            'progress': mapped,
+                            'stage': f'Separating stems from {original_filename} [{model}]... ({mapped}%)',
+                            'elapsed': format_elapsed(time.monotonic() - job_started)
+                        })
+                    
+                    logger.info(f"Running in-process separation on {run_device}: {input_path} -> {demucs_output}")
+                    try:
+                        separator.separate(
+                            input_path, demucs_output, safe_model,
+                            device=run_device,
+                            output_ext=demucs_output_fmt,
+                            clip_mode=clip_mode,
+                            shifts=shifts,
+                            segment=segment,
+                            overlap=overlap,
+                            on_progress=on_progress,
+                            stop_event=stop_event,
+                            bfloat16=CPU_BFLOAT16,
+                            gpu_half=GPU_HALF,
+                            two_stems=isolate_stem if stem_mode == 'isolate' else None,
+                        )
+                    except separator.SeparationCancelled:
+                        return 1, 'Cancelled'
+                    except Exception as e:
+                        logger.error(traceback.format_exc())
+                        return 1, str(e)
+                    return 0, ''
+                
+                run_separation = run_inprocess if DEMUCS_BACKEND == 'inprocess' else run_demucs
+                return_code, full_output = run_separation(device)
+                
+                # Retry once on CPU if the GPU run failed with a CUDA error (e.g. out of memory)
+                if return_code != 0 and device == 'cuda' and not stop_event.is_set() and is_cuda_failure(full_output):
+                    logger.warning(f"Demucs failed on CUDA for job {job_id}, retrying on CPU")
+                    return_code, full_output = run_separation('cpu')
+                
+                # Also covers a cancel that came in after the last chunk was separated
+                if stop_event.is_set():
+                    discard_cancelled()
+                    return
+                
+                if return_code != 0:
+                    logger.error(f"Demucs failed with return code {return_code}")
+                    logger.error(f"Output: {full_output}")
+                    # Clean up from active_processes
+                    with process_lock:
+                        active_processes.pop(job_id, None)
+                    report({
+                        'status': 'failed',
+                        'progress': 0,
+                        'stage': 'Processing failed',
+                        'error': 'Processing failed',
+                        'details': full_output
+                    })
+                    return
+                
+                elapsed = time.monotonic() - job_started
+                report({'status': 'processing', 'progress': 90, 'stage': f'AI separation of {original_filename} complete, organizing files...', 'elapsed': format_elapsed(elapsed)})
+                logger.info(f"Demucs completed successfully for '{original_filename}' (model={model}, segment={segment_str}), organizing output files...")
+                
+                logger.info(f"Looking for output in: {demucs_output}")
+                
+                # Move files to job output directory and collect paths
+                all_stems = expected_stems
+                # One directory scan instead of an exists() check per stem and extension
+                stem_paths = list_stem_files(demucs_output)
+                if not stem_paths:
+                    logger.warning(f"No demucs output found in {demucs_output}")
+                
+                def collect_stem(stem, output_name):
+                    """Move (or convert to FLAC) demucs' file for stem into the job directory.
+                    
+                    Returns the saved path, or None if demucs did not write the stem.
+                    """
+                    # Demucs wrote every stem as demucs_output_fmt
+                    src = stem_paths.get(f"{stem}.{demucs_output_fmt}")
+                    if not src:
+                        logger.error(f"[Stem] Demucs did not write {stem}.{demucs_output_fmt} in {demucs_output}")
+                        return None
+                    dst = safe_join(job_output_dir, f"{output_prefix}{output_name}.{actual_output_format}")
+                    if demucs_output_fmt != actual_output_format:
+                        # CLI WAV stems for a FLAC request
                         convert_to_flac(src, dst)
                     else:
-                        dst_filename = f"{original_name_no_ext}_t2s_{isolate_stem}.{ext}"
-                        dst = safe_join(job_output_dir, dst_filename)
-                        shutil.move(src, dst)
-                    logger.info(f"Isolated stem saved: {dst}")
-                    output_files[isolate_stem] = dst
-                    break
-            
-            # Now combine all other stems into "instrumental" or "backing"
-            # We'll use ffmpeg to mix them
-            other_stems = [s for s in all_stems if s != isolate_stem]
-            stem_files = []
-            for stem in other_stems:
-                for ext in [demucs_ext, 'mp3', 'wav']:
-                    src = safe_join(demucs_output, f"{stem}.{ext}")
-                    if os.path.exists(src):
-                        stem_files.append(src)
-                        break
-            
-            if stem_files:
-                # Use ffmpeg to mix the remaining stems
-                backing_name = "instrumental" if isolate_stem == "vocals" else "backing"
-                logger.info(f"[Stem] Mixing remaining stems into {backing_name}: {', '.join(other_stems)}")
-                dst_filename = f"{original_name_no_ext}_t2s_{backing_name}.{actual_output_format}"
-                dst = safe_join(job_output_dir, dst_filename)
-                
-                # Build ffmpeg command to mix multiple audio files
-                ffmpeg_cmd = ['ffmpeg', '-y']
-                for f in stem_files:
-                    ffmpeg_cmd.extend(['-i', f])
-                
-                # Create filter to mix all inputs
-                # Use normalize=1 to properly normalize the mixed output and prevent clipping
-                filter_complex = f"amix=inputs={len(stem_files)}:duration=longest:normalize=1"
-                ffmpeg_cmd.extend(['-filter_complex', filter_complex])
-                
-                # Output settings
-                if actual_output_format == 'mp3':
-                    ffmpeg_cmd.extend(['-b:a', '320k'])
-                ffmpeg_cmd.append(dst)
-                
-                logger.info(f"Mixing stems with ffmpeg: {' '.join(ffmpeg_cmd)}")
-                try:
-                    mix_result = subprocess.run(
-                        ffmpeg_cmd, capture_output=True, text=True, timeout=600
-                    )
-                except subprocess.TimeoutExpired:
-                    if os.path.exists(dst):
-                        os.remove(dst)
-                    logger.error("FFmpeg mix timed out")
+                        move_fast(src, dst)
+                    logger.info(f"Stem saved: {dst}")
+                    return dst
+                
+                if stem_mode == 'isolate':
+                    # Isolate mode: demucs wrote the isolated stem and no_{stem}, the sum of all other stems
+                    backing_name = "instrumental" if isolate_stem == "vocals" else "backing"
+                    logger.info(f"[Stem] Processing isolated stem {isolate_stem} and {backing_name}")
+                    stems_to_collect = [(isolate_stem, isolate_stem), (f"no_{isolate_stem}", backing_name)]
                 else:
-                    if mix_result.returncode == 0:
-                        output_files[backing_name] = dst
-                        logger.info(f"Created combined backing track: {dst}")
-                    else:
-                        if os.path.exists(dst):
-                            os.remove(dst)
-                        logger.error(f"FFmpeg mix failed: {mix_result.stderr}")
-        else:
-            # All stems mode: output all stems
-            for stem in all_stems:
-                logger.info(f"[Stem] Processing stem: {stem}")
-                for ext in [demucs_ext, 'mp3', 'wav']:
-                    src = safe_join(demucs_output, f"{stem}.{ext}")
-                    if os.path.exists(src):
-                        if actual_output_format == 'flac':
-                            dst_filename = f"{original_name_no_ext}_t2s_{stem}.flac"
-                            dst = safe_join(job_output_dir, dst_filename)
-                            convert_to_flac(src, dst)
-                        else:
-                            dst_filename = f"{original_name_no_ext}_t2s_{stem}.{ext}"
-                            dst = safe_join(job_output_dir, dst_filename)
-                            shutil.move(src, dst)
-                        logger.info(f"Stem saved: {dst}")
-                        output_files[stem] = dst
-                        break
-        
-        logger.info(f"Output files collected: {list(output_files.keys())}")
-        elapsed = time.time() - start_time
-        processing_status[job_id] = {'status': 'processing', 'progress': 95, 'stage': 'Cleaning up', 'elapsed': format_elapsed(elapsed)}
-        
-        # Clean up demucs directory
-        if os.path.exists(demucs_output):
-            shutil.rmtree(demucs_output)
-        parent_dir = safe_join(OUTPUT_FOLDER, model)
-        if os.path.exists(parent_dir) and not os.listdir(parent_dir):
-            os.rmdir(parent_dir)
-        
-        # Clean up input file
-        if os.path.exists(input_path):
-            os.remove(input_path)
-            logger.info(f"Cleaned up input file: {input_path}")
-        
-        # Calculate total processing time
-        end_time = time.time()
-        total_time = end_time - start_time
-        minutes = int(total_time // 60)
-        seconds = int(total_time % 60)
-        time_str = f"{minutes}m {seconds}s" if minutes > 0 else f"{seconds}s"
-        
-        processing_status[job_id] = {'status': 'completed', 'progress': 100, 'stage': 'Complete!', 'elapsed': time_str, 'total_time': time_str}
-        logger.info(f"=== Job {job_id} completed: file='{original_filename}', model={model}, segment={segment_str}, stems={len(output_files)}, time={time_str} ===")
-        
-        # Clean up from active_processes
-        with process_lock:
-            if job_id in active_processes:
-                del active_processes[job_id]
+                    # All stems mode: output all stems
+                    logger.info(f"[Stem] Processing stems: {', '.join(all_stems)}")
+                    stems_to_collect = [(stem, stem) for stem in all_stems]
+                
+                if demucs_output_fmt != actual_output_format:
+                    # Each FLAC conversion is its own ffmpeg process; run them side by side
+                    workers = min(len(stems_to_collect), CPU_THREADS)
+                    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='flac') as executor:
+                        saved = list(executor.map(lambda names: collect_stem(*names), stems_to_collect))
+                else:
+                    saved = [collect_stem(stem, output_name) for stem, output_name in stems_to_collect]
+                output_files = {
+                    output_name: dst
+                    for (_, output_name), dst in zip(stems_to_collect, saved)
+                    if dst is not None
+                }
+                
+                logger.info(f"Output files collected: {list(output_files.keys())}")
+                
+                # Only cache complete results so a partial one is not served again
+                expected_outputs = 2 if stem_mode == 'isolate' else len(all_stems)
+                if cache_key and len(output_files) == expected_outputs:
+                    try:
+                        store_cached_result(cache_key, output_files)
+                    except OSError as e:
+                        logger.warning(f"Could not cache results for job {job_id}: {e}")
+                
+                # Calculate total processing time
+                time_str = format_elapsed(time.monotonic() - job_started)
+                
+                # Clean up from active_processes; once the entry is gone the job can
+                # no longer be cancelled, so the stop event is settled
+                with process_lock:
+                    active_processes.pop(job_id, None)
+                if stop_event.is_set():
+                    discard_cancelled()
+                    return
+                
+                report({
+                    'status': 'completed',
+                    'progress': 100,
+                    'stage': 'Complete!',
+                    'elapsed': time_str,
+                    'total_time': time_str,
+                    'job_id': job_id,
+                    'outputs': output_files,
+                    'format': actual_output_format,
+                    'processing_time': time_str
+                })
+                logger.info(f"=== Job {job_id} completed: file='{original_filename}', model={model}, segment={segment_str}, stems={len(output_files)}, time={time_str} ===")
+                
+                # Remove demucs' directory and the upload after the job is reported complete;
+                # a failure here must not reach the handlers below and mark the job failed
+                try:
+                    cleanup_executor.submit(cleanup_job_files, demucs_output, model_output_dir, input_path)
+                except RuntimeError:
+                    # The executor refuses new work once the interpreter is shutting down
+                    cleanup_job_files(demucs_output, model_output_dir, input_path)
+            except subprocess.TimeoutExpired:
+                logger.error("Processing timeout exceeded")
+                report({'status': 'failed', 'progress': 0, 'stage': 'Timeout', 'error': 'Processing timeout'})
+            except Exception as e:
+                logger.error(f"Unexpected error: {str(e)}")
+                logger.error(traceback.format_exc())
+                report({'status': 'failed', 'progress': 0, 'stage': 'Error', 'error': 'Internal server error'})
+            finally:
+                with process_lock:
+                    active_processes.pop(job_id, None)
         
-        return jsonify({
-            'status': 'completed',
-            'job_id': job_id,
-            'outputs': output_files,
-            'format': actual_output_format,
-            'processing_time': time_str
-        })
+        processing_status[job_id] = {'status': 'queued', 'progress': 10, 'stage': f'Queued {original_filename} for separation'}
+        submit_job(run_job)
+        logger.info(f"Job {job_id} queued for separation")
+        status_url = url_for('get_status', job_id=job_id)
+        return jsonify({'status': 'queued', 'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
     
-    except subprocess.TimeoutExpired:
-        logger.error("Processing timeout exceeded")
-        if job_id:
-            processing_status[job_id] = {'status': 'failed', 'progress': 0, 'stage': 'Timeout'}
-        return jsonify({'error': 'Processing timeout'}), 500
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,152 @@
+"""In-process demucs separation.
+
+Running ``python -m demucs`` per job re-imports torch and reloads the model
+checkpoint every time. This module keeps loaded models in memory so only the
+first job for a given model pays that cost. torch and demucs are imported
+lazily so the Flask app (and its tests) can import this module without them.
+"""
+import contextlib
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Loaded demucs models, keyed by model name
+_models = {}
+_models_lock = threading.Lock()
+# Demucs models are not reentrant; run one separation at a time
+_inference_lock = threading.Lock()
+
+
+class SeparationCancelled(Exception):
+    """Raised when a separation is stopped through its stop event."""
+
+
+def get_model(name):
+    """Return the demucs model for ``name``, loading it on first use."""
+    with _models_lock:
+        model = _models.get(name)
+        if model is None:
+            from demucs.pretrained import get_model as load_model
+            logger.info(f"Loading demucs model {name}")
+            model = load_model(name)
+            model.eval()
+            _models[name] = model
+        return model
+
+
+def count_chunks(model, length, segment=None, overlap=0.25, shifts=0):
+    """Estimate how many chunks apply_model will run for a track of ``length`` samples."""
+    sub_models = getattr(model, 'models', [model])
+    total = 0
+    for sub_model in sub_models:
+        seg = segment if segment is not None else sub_model.segment
+        segment_length = int(sub_model.samplerate * seg)
+        stride = max(1, int((1 - overlap) * segment_length))
+        total += math.ceil(length / stride)
+    return total * max(1, shifts)
+
+
+class ProgressPool:
+    """Executor passed to demucs' apply_model that runs chunks lazily.
+
+    Each chunk is computed when apply_model collects its result, which lets us
+    report progress per chunk and stop between chunks when cancelled.
+    """
+
+    class _Result:
+        def __init__(self, pool, func, args, kwargs):
+            self.pool = pool
+            self.func = func
+            self.args = args
+            self.kwargs = kwargs
+
+        def result(self):
+            return self.pool._run(self.func, self.args, self.kwargs)
+
+    def __init__(self, total, on_progress=None, stop_event=None):
+        self.total = max(1, total)
+        self.done = 0
+        self.on_progress = on_progress
+        self.stop_event = stop_event
+
+    def submit(self, func, *args, **kwargs):
+        return ProgressPool._Result(self, func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SeparationCancelled()
+        out = func(*args, **kwargs)
+        self.done += 1
+        if self.on_progress is not None:
+            self.on_progress(min(1.0, self.done / self.total))
+        return out
+
+
+def separate(input_path, output_dir, model_name, device='cpu', output_ext='mp3',
+             clip_mode='rescale', shifts=0, segment=None, overlap=None,
+             on_progress=None, stop_event=None, bfloat16=False, gpu_half=False,
+             two_stems=None):
+    """Separate ``input_path`` into ``output_dir/{stem}.{output_ext}`` files.
+
+    Mirrors what ``python -m demucs`` does for a single track and returns a
+    dict mapping stem names to the written file paths. With ``bfloat16`` the
+    CPU matmuls and convolutions run under bfloat16 autocast, which is faster
+    on CPUs with native bf16 support at a small cost in accuracy.
+    ``gpu_half`` does the same on CUDA, using bfloat16 where the GPU supports
+    it and float16 otherwise. With ``two_stems`` only that stem and
+    ``no_{stem}``, the sum of all the other stems, are written, like the
+    CLI's ``--two-stems``.
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import AudioFile, save_audio
+
+    model = get_model(model_name)
+    # Same defaults as the demucs CLI
+    if overlap is None:
+        overlap = 0.25
+    if not shifts:
+        shifts = 1
+
+    wav = AudioFile(input_path).read(
+        streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+
+    # Same normalization as the demucs CLI
+    ref = wav.mean(0)
+    wav -= ref.mean()
+    wav /= ref.std()
+
+    pool = ProgressPool(
+        count_chunks(model, wav.shape[-1], segment, overlap, shifts),
+        on_progress, stop_event)
+    if bfloat16 and device == 'cpu':
+        autocast = torch.autocast('cpu', dtype=torch.bfloat16)
+    elif gpu_half and device == 'cuda':
+        # float16 for GPUs without bf16 (pre-Ampere); weights stay float32
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        autocast = torch.autocast('cuda', dtype=dtype)
+    else:
+        autocast = contextlib.nullcontext()
+    # inference_mode also skips the version counters and view tracking no_grad keeps
+    with _inference_lock, autocast, torch.inference_mode():
+        sources = apply_model(model, wav[None], device=device, shifts=shifts,
+                              split=True, overlap=overlap, segment=segment,
+                              pool=pool)[0].float()
+    # Inference tensors cannot be modified in place outside inference_mode
+    sources = sources * ref.std() + ref.mean()
+
+    stems = dict(zip(model.sources, sources))
+    if two_stems is not None:
+        isolated = stems.pop(two_stems)
+        stems = {two_stems: isolated, f"no_{two_stems}": sum(stems.values())}
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    for name, source in stems.items():
+        path = os.path.join(output_dir, f"{name}.{output_ext}")
+        save_audio(source, path, samplerate=model.samplerate, bitrate=320, clip=clip_mode)
+        outputs[name] = path
+    return outputs
@@ -2,22 +2,35 @@
 import os
 import json
 import io
+import errno
+import hashlib
+import time
 import pytest
 
 from app import (
     validate_job_id,
     safe_join,
     app,
-    ALLOWED_STEMS,
     ALLOWED_OUTPUT_FORMATS,
-    ALLOWED_STEM_MODES,
     ALLOWED_MODELS,
     ALLOWED_DEMUCS_MODELS,
-    ALLOWED_CLIP_MODES,
-    ALLOWED_SHIFTS,
-    ALLOWED_SEGMENTS,
-    ALLOWED_OVERLAPS,
     SIX_STEM_MODELS,
+    ALLOWED_DEVICES,
+    resolve_device,
+    is_cuda_failure,
+    default_segment,
+    result_cache_key,
+    load_cached_result,
+    store_cached_result,
+    StatusStore,
+    processing_status,
+    move_fast,
+    allowed_file,
+    is_wav_file,
+    list_stem_files,
+    cpu_thread_count,
+    save_upload,
+    upload_digest,
 )
 
 
@@ -39,6 +52,9 @@ class TestValidateJobId:
     def test_none(self):
         assert validate_job_id(None) is False
 
+    def test_trailing_newline(self):
+        assert validate_job_id('abc123\n') is False
+
     def test_path_traversal_dots(self):
         assert validate_job_id('../../etc') is False
 
@@ -113,6 +129,31 @@ class TestEndpointValidation:
         resp = client.get('/status/abc-123-def')
         assert resp.status_code == 200
 
+    def test_status_estimates_cli_progress(self, client, monkeypatch):
+        import app as app_module
+        processing_status['estimated-job'] = {'status': 'processing', 'progress': 20, 'stage': 'Separating'}
+        monkeypatch.setitem(app_module.estimated_jobs, 'estimated-job', time.monotonic() - 150)
+        data = json.loads(client.get('/status/estimated-job').data)
+        assert data['progress'] == 47
+        assert data['stage'] == 'Processing audio... (47%)'
+        # Real progress ahead of the estimate is reported as is
+        processing_status['estimated-job'] = {'status': 'processing', 'progress': 60, 'stage': 'Separating'}
+        data = json.loads(client.get('/status/estimated-job').data)
+        assert data == {'status': 'processing', 'progress': 60, 'stage': 'Separating'}
+
+    def test_status_not_modified(self, client):
+        processing_status['etag-job'] = {'status': 'processing', 'progress': 20, 'stage': 'Separating'}
+        resp = client.get('/status/etag-job')
+        etag = resp.headers['ETag']
+        resp = client.get('/status/etag-job', headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+        assert resp.data == b''
+        processing_status['etag-job'] = {'status': 'processing', 'progress': 30, 'stage': 'Separating'}
+        resp = client.get('/status/etag-job', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert json.loads(resp.data)['progress'] == 30
+        assert resp.headers['ETag'] != etag
+
     def test_cancel_invalid_job_id(self, client):
         resp = client.post('/cancel/abc;rm -rf')
         assert resp.status_code == 400
@@ -134,26 +175,24 @@ class TestEndpointValidation:
         body = json.loads(resp.data)
         assert body['error'] == 'Invalid job ID'
 
-    def test_process_invalid_output_format(self, client):
-        data = {
-            'job_id': 'valid-job-123',
-            'output_format': 'exe',
-            'stem_mode': 'all',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid output format'
-
-    def test_process_invalid_stem_mode(self, client):
+    @pytest.mark.parametrize('field,value,error', [
+        ('output_format', 'exe', 'Invalid output format'),
+        ('stem_mode', 'malicious', 'Invalid stem mode'),
+        ('clip_mode', 'delete', 'Invalid clip mode'),
+        ('shifts', '99', 'Invalid shifts value'),
+        ('shifts', 'abc', 'Invalid shifts value'),
+        ('segment', '999', 'Invalid segment value'),
+        ('segment', 'xyz', 'Invalid segment value'),
+        ('overlap', '0.99', 'Invalid overlap value'),
+        ('overlap', 'not-a-number', 'Invalid overlap value'),
+        ('device', 'tpu', 'Invalid device'),
+    ])
+    def test_process_invalid_option(self, client, field, value, error):
         data = {
             'job_id': 'valid-job-123',
             'output_format': 'mp3',
-            'stem_mode': 'malicious',
+            'stem_mode': 'all',
+            field: value,
         }
         resp = client.post(
             '/process',
@@ -162,7 +201,7 @@ class TestEndpointValidation:
         )
         assert resp.status_code == 400
         body = json.loads(resp.data)
-        assert body['error'] == 'Invalid stem mode'
+        assert body['error'] == error
 
     def test_process_invalid_isolate_stem(self, client):
         data = {
@@ -197,70 +236,6 @@ class TestEndpointValidation:
         assert body['error'] == 'Invalid model'
         assert body['allowed_models'] == sorted(ALLOWED_DEMUCS_MODELS)
 
-    def test_process_invalid_clip_mode(self, client):
-        data = {
-            'job_id': 'valid-job-789',
-            'output_format': 'wav',
-            'stem_mode': 'all',
-            'clip_mode': 'delete',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid clip mode'
-
-    def test_process_invalid_shifts(self, client):
-        data = {
-            'job_id': 'valid-job-aaa',
-            'output_format': 'mp3',
-            'stem_mode': 'all',
-            'shifts': '99',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid shifts value'
-
-    def test_process_invalid_segment(self, client):
-        data = {
-            'job_id': 'valid-job-bbb',
-            'output_format': 'mp3',
-            'stem_mode': 'all',
-            'segment': '999',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid segment value'
-
-    def test_process_invalid_overlap(self, client):
-        data = {
-            'job_id': 'valid-job-ccc',
-            'output_format': 'flac',
-            'stem_mode': 'all',
-            'overlap': '0.99',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid overlap value'
-
     def test_process_flac_format_accepted(self, client):
         """Verify 'flac' is accepted by the output_format validator."""
         assert 'flac' in ALLOWED_OUTPUT_FORMATS
@@ -272,54 +247,6 @@ class TestEndpointValidation:
                     'mdx_q', 'mdx_extra_q'}
         assert expected.issubset(ALLOWED_MODELS)
 
-    def test_process_non_numeric_shifts(self, client):
-        data = {
-            'job_id': 'valid-job-nn1',
-            'output_format': 'mp3',
-            'stem_mode': 'all',
-            'shifts': 'abc',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid shifts value'
-
-    def test_process_non_numeric_segment(self, client):
-        data = {
-            'job_id': 'valid-job-nn2',
-            'output_format': 'mp3',
-            'stem_mode': 'all',
-            'segment': 'xyz',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid segment value'
-
-    def test_process_non_numeric_overlap(self, client):
-        data = {
-            'job_id': 'valid-job-nn3',
-            'output_format': 'mp3',
-            'stem_mode': 'all',
-            'overlap': 'not-a-number',
-        }
-        resp = client.post(
-            '/process',
-            data={**data, 'file': (io.BytesIO(b'fake audio'), 'test.mp3')},
-            content_type='multipart/form-data',
-        )
-        assert resp.status_code == 400
-        body = json.loads(resp.data)
-        assert body['error'] == 'Invalid overlap value'
-
     def test_process_incompatible_isolate_stem_for_4stem_model(self, client):
         """4-stem models should reject guitar/piano in isolate mode."""
         data = {
@@ -350,3 +277,438 @@ class TestModelStemMapping:
                      'mdx', 'mdx_extra', 'mdx_q', 'mdx_extra_q'}
         for m in four_stem:
             assert m not in SIX_STEM_MODELS
+
+
+class TestDeviceSelection:
+    """Verify demucs device resolution and CUDA failure detection."""
+
+    def test_allowed_devices(self):
+        assert ALLOWED_DEVICES == {'auto', 'cpu', 'cuda'}
+
+    def test_cpu_always_resolves_to_cpu(self):
+        assert resolve_device('cpu') == 'cpu'
+
+    def test_cuda_falls_back_without_gpu(self, monkeypatch):
+        monkeypatch.setattr('app.HAS_CUDA', False)
+        assert resolve_device('cuda') == 'cpu'
+        assert resolve_device('auto') == 'cpu'
+
+    def test_auto_uses_gpu_when_available(self, monkeypatch):
+        monkeypatch.setattr('app.HAS_CUDA', True)
+        assert resolve_device('auto') == 'cuda'
+
+    def test_cuda_oom_detected(self):
+        assert is_cuda_failure('RuntimeError: CUDA out of memory. Tried to allocate 2.00 GiB')
+
+    def test_regular_failure_not_cuda(self):
+        assert not is_cuda_failure('Could not load file track.mp3')
+
+
+class TestDefaultSegment:
+    """Verify the default demucs segment per device and model."""
+
+    def test_cpu_keeps_model_default(self, monkeypatch):
+        monkeypatch.delenv('DEMUCS_SEGMENT', raising=False)
+        assert default_segment('htdemucs_6s', 'cpu') is None
+
+    def test_gpu_uses_short_segment(self, monkeypatch):
+        monkeypatch.delenv('DEMUCS_SEGMENT', raising=False)
+        assert default_segment('mdx_extra', 'cuda') == 7
+
+    def test_env_override(self, monkeypatch):
+        monkeypatch.setenv('DEMUCS_SEGMENT', '20')
+        assert default_segment('mdx_extra', 'cpu') == 20
+
+    def test_transformer_models_capped(self, monkeypatch):
+        monkeypatch.setenv('DEMUCS_SEGMENT', '20')
+        assert default_segment('htdemucs_6s', 'cpu') == 7
+
+    def test_invalid_env_ignored(self, monkeypatch):
+        monkeypatch.setenv('DEMUCS_SEGMENT', 'abc')
+        assert default_segment('mdx_extra', 'cpu') is None
+
+
+class TestResultCache:
+    """Verify the content-addressed result cache."""
+
+    def test_key_depends_on_options(self):
+        assert result_cache_key('abc', 'htdemucs', 'mp3') != result_cache_key('abc', 'htdemucs', 'wav')
+        assert result_cache_key('abc', 'htdemucs', 'mp3') == result_cache_key('abc', 'htdemucs', 'mp3')
+
+    def test_miss_returns_none(self, tmp_path):
+        assert load_cached_result(result_cache_key('missing'), str(tmp_path), 'song_t2s_') is None
+
+    def test_store_then_load(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        src_dir.mkdir()
+        vocals = src_dir / 'song_t2s_vocals.mp3'
+        vocals.write_bytes(b'vocals')
+        key = result_cache_key('digest-store-load', 'htdemucs_6s', 'mp3')
+        store_cached_result(key, {'vocals': str(vocals)})
+
+        job_dir = tmp_path / 'job'
+        job_dir.mkdir()
+        outputs = load_cached_result(key, str(job_dir), 'other_t2s_')
+        assert list(outputs) == ['vocals']
+        assert outputs['vocals'].endswith('other_t2s_vocals.mp3')
+        with open(outputs['vocals'], 'rb') as f:
+            assert f.read() == b'vocals'
+
+
+class TestCpuThreadCount:
+    """Verify the CPU thread count honors affinity and the cgroup quota."""
+
+    def test_within_affinity(self):
+        assert 1 <= cpu_thread_count() <= len(os.sched_getaffinity(0))
+
+    def test_cgroup_quota_caps_count(self, monkeypatch):
+        real_open = open
+
+        def fake_open(path, *args, **kwargs):
+            if path == '/sys/fs/cgroup/cpu.max':
+                return io.StringIO('50000 100000\n')
+            return real_open(path, *args, **kwargs)
+
+        monkeypatch.setattr('builtins.open', fake_open)
+        assert cpu_thread_count() == 1
+
+
+class TestAllowedFile:
+    """Verify upload extension checks."""
+
+    def test_allowed_extensions(self):
+        assert allowed_file('song.mp3')
+        assert allowed_file('my.song.FLAC')
+        assert not allowed_file('song.exe')
+        assert not allowed_file('mp3')
+        assert not allowed_file('song.')
+
+    def test_is_wav_file(self):
+        assert is_wav_file('take.WAV')
+        assert not is_wav_file('take.mp3')
+        assert not is_wav_file('wav')
+
+
+class TestListStemFiles:
+    """Verify demucs output directories are listed in one scan."""
+
+    def test_lists_files_only(self, tmp_path):
+        (tmp_path / 'vocals.mp3').write_bytes(b'v')
+        (tmp_path / 'drums.wav').write_bytes(b'd')
+        (tmp_path / 'nested').mkdir()
+        assert list_stem_files(str(tmp_path)) == {
+            'vocals.mp3': str(tmp_path / 'vocals.mp3'),
+            'drums.wav': str(tmp_path / 'drums.wav'),
+        }
+
+    def test_missing_directory(self, tmp_path):
+        assert list_stem_files(str(tmp_path / 'missing')) == {}
+
+
+class TestMoveFast:
+    """Verify stems are moved by rename, with a copy across filesystems."""
+
+    def test_rename(self, tmp_path):
+        src = tmp_path / 'vocals.mp3'
+        src.write_bytes(b'vocals')
+        inode = src.stat().st_ino
+        dst = tmp_path / 'song_t2s_vocals.mp3'
+        move_fast(str(src), str(dst))
+        assert not src.exists()
+        assert dst.stat().st_ino == inode
+
+    def test_replaces_existing(self, tmp_path):
+        src = tmp_path / 'bass.mp3'
+        src.write_bytes(b'new')
+        dst = tmp_path / 'song_t2s_bass.mp3'
+        dst.write_bytes(b'old')
+        move_fast(str(src), str(dst))
+        assert dst.read_bytes() == b'new'
+
+    def test_cross_device_copies(self, tmp_path, monkeypatch):
+        def replace_exdev(src, dst):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        monkeypatch.setattr('app.os.replace', replace_exdev)
+        src = tmp_path / 'drums.mp3'
+        src.write_bytes(b'drums')
+        dst = tmp_path / 'song_t2s_drums.mp3'
+        move_fast(str(src), str(dst))
+        assert not src.exists()
+        assert dst.read_bytes() == b'drums'
+
+    def test_cross_device_without_copy_file_range(self, tmp_path, monkeypatch):
+        def fail_exdev(*args):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        monkeypatch.setattr('app.os.replace', fail_exdev)
+        monkeypatch.setattr('app.os.copy_file_range', fail_exdev, raising=False)
+        src = tmp_path / 'other.mp3'
+        src.write_bytes(b'other' * 1000)
+        dst = tmp_path / 'song_t2s_other.mp3'
+        move_fast(str(src), str(dst))
+        assert not src.exists()
+        assert dst.read_bytes() == b'other' * 1000
+
+
+class TestUploadRequest:
+    """Verify uploaded files are spooled into the upload folder."""
+
+    def test_file_stream_in_upload_folder(self):
+        import app as app_module
+        data = {'file': (io.BytesIO(b'spooled audio'), 'song.mp3')}
+        with app.test_request_context('/process', method='POST', data=data,
+                                      content_type='multipart/form-data'):
+            from flask import request
+            stream = request.files['file'].stream
+            assert os.path.dirname(stream.name) == app_module.UPLOAD_FOLDER
+            stream.seek(0)
+            assert stream.read() == b'spooled audio'
+
+    def test_save_upload_links_spool(self):
+        import app as app_module
+        data = {'file': (io.BytesIO(b'spooled audio'), 'song.mp3')}
+        dst = os.path.join(app_module.UPLOAD_FOLDER, 'job_song.mp3')
+        try:
+            with app.test_request_context('/process', method='POST', data=data,
+                                          content_type='multipart/form-data'):
+                from flask import request
+                file = request.files['file']
+                assert save_upload(file, dst) == len(b'spooled audio')
+                assert os.path.samefile(file.stream.name, dst)
+            with open(dst, 'rb') as f:
+                assert f.read() == b'spooled audio'
+        finally:
+            os.remove(dst)
+
+    def test_upload_digest_from_spool(self):
+        data = {'file': (io.BytesIO(b'spooled audio'), 'song.mp3')}
+        with app.test_request_context('/process', method='POST', data=data,
+                                      content_type='multipart/form-data'):
+            from flask import request
+            file = request.files['file']
+            assert upload_digest(file, None) == hashlib.sha256(b'spooled audio').hexdigest()
+
+    def test_save_upload_copies_other_streams(self, tmp_path):
+        from werkzeug.datastructures import FileStorage
+        dst = str(tmp_path / 'song.mp3')
+        assert save_upload(FileStorage(io.BytesIO(b'audio'), 'song.mp3'), dst) == 5
+        with open(dst, 'rb') as f:
+            assert f.read() == b'audio'
+
+
+class TestProcessPipeline:
+    """Run /process end to end with demucs replaced by a fake separator."""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        calls = []
+
+        def fake_separate(input_path, output_dir, model_name, output_ext='mp3', two_stems=None, **kwargs):
+            calls.append(input_path)
+            os.makedirs(output_dir, exist_ok=True)
+            stems = (two_stems, f'no_{two_stems}') if two_stems else ('vocals', 'drums', 'bass', 'other')
+            for stem in stems:
+                with open(os.path.join(output_dir, f"{stem}.{output_ext}"), 'wb') as f:
+                    f.write(stem.encode())
+
+        monkeypatch.setattr('app.DEMUCS_BACKEND', 'inprocess')
+        monkeypatch.setattr('app.separator.separate', fake_separate)
+        app.config['TESTING'] = True
+        with app.test_client() as client:
+            client.separate_calls = calls
+            yield client
+
+    def _post(self, client, job_id, audio=b'pipeline audio', **fields):
+        return client.post(
+            '/process',
+            data={
+                'job_id': job_id,
+                'output_format': 'mp3',
+                'stem_mode': 'all',
+                'model': 'htdemucs',
+                'file': (io.BytesIO(audio), 'song.mp3'),
+                **fields,
+            },
+            content_type='multipart/form-data',
+        )
+
+    def _wait(self, client, job_id, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            body = json.loads(client.get(f'/status/{job_id}').data)
+            if body['status'] in ('completed', 'failed', 'cancelled'):
+                return body
+            time.sleep(0.05)
+        raise AssertionError(f'job {job_id} did not finish')
+
+    def test_returns_accepted(self, client):
+        resp = self._post(client, 'pipeline-job-0', b'accepted audio')
+        assert resp.status_code == 202
+        body = json.loads(resp.data)
+        assert body == {
+            'status': 'queued',
+            'job_id': 'pipeline-job-0',
+            'status_url': '/status/pipeline-job-0',
+        }
+        assert resp.headers['Location'].endswith('/status/pipeline-job-0')
+        self._wait(client, 'pipeline-job-0')
+
+    def test_health_reports_job_counts(self, client):
+        self._post(client, 'pipeline-job-h', b'health audio')
+        self._wait(client, 'pipeline-job-h')
+        deadline = time.monotonic() + 10
+        while True:
+            body = json.loads(client.get('/health').data)
+            if body['jobs'] == {'queued': 0, 'running': 0} or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        assert body == {'status': 'ok', 'jobs': {'queued': 0, 'running': 0}, 'max_concurrent_jobs': 1}
+
+    def test_all_stems(self, client):
+        resp = self._post(client, 'pipeline-job-1', b'all stems audio')
+        assert resp.status_code == 202
+        body = self._wait(client, 'pipeline-job-1')
+        assert body['status'] == 'completed'
+        assert set(body['outputs']) == {'vocals', 'drums', 'bass', 'other'}
+        assert body['outputs']['vocals'].endswith('song_t2s_vocals.mp3')
+        with open(body['outputs']['drums'], 'rb') as f:
+            assert f.read() == b'drums'
+
+    def test_isolate_stem(self, client):
+        resp = self._post(client, 'pipeline-job-4', b'isolate audio', stem_mode='isolate', isolate_stem='vocals')
+        assert resp.status_code == 202
+        body = self._wait(client, 'pipeline-job-4')
+        assert body['status'] == 'completed'
+        assert set(body['outputs']) == {'vocals', 'instrumental'}
+        assert body['outputs']['instrumental'].endswith('song_t2s_instrumental.mp3')
+        with open(body['outputs']['instrumental'], 'rb') as f:
+            assert f.read() == b'no_vocals'
+
+    def test_flac_written_directly(self, client, monkeypatch):
+        def fail_convert(src, dst):
+            raise AssertionError('FLAC should not be converted from WAV in-process')
+
+        monkeypatch.setattr('app.convert_to_flac', fail_convert)
+        assert self._post(client, 'pipeline-job-5', b'flac audio', output_format='flac').status_code == 202
+        body = self._wait(client, 'pipeline-job-5')
+        assert body['status'] == 'completed'
+        assert body['outputs']['vocals'].endswith('song_t2s_vocals.flac')
+
+    def test_cancel_before_start(self, client, monkeypatch):
+        jobs = []
+        monkeypatch.setattr('app.submit_job', jobs.append)
+        assert self._post(client, 'pipeline-job-6', b'cancelled audio').status_code == 202
+        resp = client.post('/cancel/pipeline-job-6')
+        assert json.loads(resp.data) == {'status': 'cancelled', 'job_id': 'pipeline-job-6'}
+        jobs[0]()
+        assert json.loads(client.get('/status/pipeline-job-6').data)['status'] == 'cancelled'
+        assert client.separate_calls == []
+
+    def test_job_without_status_skipped(self, client, monkeypatch):
+        import app as app_module
+        jobs = []
+        monkeypatch.setattr('app.submit_job', jobs.append)
+        assert self._post(client, 'pipeline-job-8', b'expired audio').status_code == 202
+        # Dropped from the store while queued
+        del app_module.processing_status._entries['pipeline-job-8']
+        jobs[0]()
+        assert client.separate_calls == []
+        assert not os.path.exists(os.path.join(app_module.UPLOAD_FOLDER, 'pipeline-job-8_song.mp3'))
+
+    def test_completed_when_cleanup_cannot_be_queued(self, client, monkeypatch):
+        import app as app_module
+
+        class ShutDownExecutor:
+            def submit(self, *args):
+                raise RuntimeError('cannot schedule new futures after interpreter shutdown')
+
+        monkeypatch.setattr('app.cleanup_executor', ShutDownExecutor())
+        assert self._post(client, 'pipeline-job-11', b'shutdown audio').status_code == 202
+        assert self._wait(client, 'pipeline-job-11')['status'] == 'completed'
+        # Cleaned up in the job thread instead, right after the job is reported complete
+        input_path = os.path.join(app_module.UPLOAD_FOLDER, 'pipeline-job-11_song.mp3')
+        deadline = time.monotonic() + 10
+        while os.path.exists(input_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(input_path)
+        assert json.loads(client.get('/status/pipeline-job-11').data)['status'] == 'completed'
+
+    def test_cancel_after_separation(self, client, monkeypatch):
+        import app as app_module
+        fake_separate = app_module.separator.separate
+        cancelled = []
+
+        def separate_then_cancel(*args, **kwargs):
+            outputs = fake_separate(*args, **kwargs)
+            # The last chunk is done when the cancel arrives
+            cancelled.append(app.test_client().post('/cancel/pipeline-job-7').status_code)
+            return outputs
+
+        monkeypatch.setattr('app.separator.separate', separate_then_cancel)
+        assert self._post(client, 'pipeline-job-7', b'late cancel audio').status_code == 202
+        # The job thread removes the upload last, after its outputs
+        input_path = os.path.join(app_module.UPLOAD_FOLDER, 'pipeline-job-7_song.mp3')
+        deadline = time.monotonic() + 10
+        while os.path.exists(input_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(input_path)
+        assert not os.path.exists(os.path.join(app_module.OUTPUT_FOLDER, 'pipeline-job-7'))
+        assert cancelled == [200]
+        assert json.loads(client.get('/status/pipeline-job-7').data)['status'] == 'cancelled'
+
+    def test_repeat_upload_served_from_cache(self, client):
+        assert self._post(client, 'pipeline-job-2', b'cached audio').status_code == 202
+        assert self._wait(client, 'pipeline-job-2')['status'] == 'completed'
+        resp = self._post(client, 'pipeline-job-3', b'cached audio')
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body['cached'] is True
+        assert len(client.separate_calls) == 1
+        assert set(body['outputs']) == {'vocals', 'drums', 'bass', 'other'}
+        status = json.loads(client.get('/status/pipeline-job-3').data)
+        assert status['status'] == 'completed'
+        assert status['outputs'] == body['outputs']
+        assert status['format'] == 'mp3'
+
+    def test_precision_setting_not_served_from_cache(self, client, monkeypatch):
+        assert self._post(client, 'pipeline-job-9', b'precision audio').status_code == 202
+        assert self._wait(client, 'pipeline-job-9')['status'] == 'completed'
+        monkeypatch.setattr('app.CPU_BFLOAT16', True)
+        assert self._post(client, 'pipeline-job-10', b'precision audio').status_code == 202
+        assert self._wait(client, 'pipeline-job-10')['status'] == 'completed'
+        assert len(client.separate_calls) == 2
+
+
+class TestStatusStore:
+    """Verify bounded, expiring job status storage."""
+
+    def test_set_and_get(self):
+        store = StatusStore()
+        store['job-1'] = {'status': 'processing', 'progress': 10}
+        assert 'job-1' in store
+        assert store['job-1']['progress'] == 10
+        assert store.get('missing') is None
+
+    def test_evicts_least_recently_written(self):
+        store = StatusStore(max_entries=2)
+        store['job-1'] = {'progress': 1}
+        store['job-2'] = {'progress': 2}
+        store['job-1'] = {'progress': 3}
+        store['job-3'] = {'progress': 4}
+        assert 'job-2' not in store
+        assert 'job-1' in store and 'job-3' in store
+
+    def test_expired_entries_swept(self):
+        store = StatusStore(ttl=0, sweep_interval=0)
+        store['job-1'] = {'progress': 1}
+        store['job-2'] = {'progress': 2}
+        assert 'job-1' not in store
+
+    def test_active_jobs_not_expired(self):
+        store = StatusStore(ttl=0, sweep_interval=0)
+        store['job-1'] = {'status': 'queued', 'progress': 10}
+        store['job-2'] = {'status': 'completed', 'progress': 100}
+        store['job-3'] = {'status': 'processing', 'progress': 50}
+        assert 'job-1' in store and 'job-3' in store
+        assert 'job-2' not in store
@@ -0,0 +1,55 @@
+"""Tests for the in-process demucs helpers in processor/separator.py"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from separator import ProgressPool, SeparationCancelled, count_chunks
+
+
+def _fake_model(segment=8, samplerate=100):
+    return SimpleNamespace(segment=segment, samplerate=samplerate)
+
+
+class TestCountChunks:
+    """Verify the chunk estimate used for progress reporting."""
+
+    def test_single_model(self):
+        # 800-sample segments with 25% overlap -> stride 600
+        assert count_chunks(_fake_model(), 1200, overlap=0.25) == 2
+
+    def test_shifts_multiply_passes(self):
+        assert count_chunks(_fake_model(), 1200, overlap=0.25, shifts=3) == 6
+
+    def test_bag_of_models(self):
+        bag = SimpleNamespace(models=[_fake_model(), _fake_model()])
+        assert count_chunks(bag, 1200, overlap=0.25) == 4
+
+    def test_segment_override(self):
+        assert count_chunks(_fake_model(), 1000, segment=2, overlap=0.5) == 10
+
+
+class TestProgressPool:
+    """Verify lazy chunk execution, progress reporting and cancellation."""
+
+    def test_reports_progress_per_chunk(self):
+        reported = []
+        pool = ProgressPool(2, on_progress=reported.append)
+        futures = [pool.submit(lambda x: x * 2, i) for i in range(2)]
+        assert [f.result() for f in futures] == [0, 2]
+        assert reported == [0.5, 1.0]
+
+    def test_progress_capped_at_one(self):
+        reported = []
+        pool = ProgressPool(1, on_progress=reported.append)
+        for _ in range(3):
+            pool.submit(lambda: None).result()
+        assert reported[-1] == 1.0
+
+    def test_cancelled_before_chunk(self):
+        stop = threading.Event()
+        pool = ProgressPool(2, stop_event=stop)
+        future = pool.submit(lambda: 1)
+        stop.set()
+        with pytest.raises(SeparationCancelled):
+            future.result()